@@ -5,7 +5,7 @@ from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordResetForm, PasswordChangeForm, SetPasswordForm
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.urlresolvers import reverse_lazy
+from django.core.urlresolvers import reverse
 from django.utils.encoding import force_text, force_bytes
 from django.utils.http import urlsafe_base64_encode
 from django.utils.translation import ugettext_lazy as _
@@ -135,9 +135,10 @@ class MyPasswordResetForm(BaseFormHelper, PasswordResetForm):
                 'email': user.email,
                 'domain': domain,
                 'site_name': site_name,
-                'user': user,
+                # plain values only, task arguments are sent as JSON
+                'user': {'username': user.username},
                 'protocol': 'https' if use_https else 'http',
-                'token_url': reverse_lazy('account_password_reset_confirm', kwargs={
+                'token_url': reverse('account_password_reset_confirm', kwargs={
                     'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
                     'token': user.token.last().token,
                 })
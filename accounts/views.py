@@ -5,7 +5,7 @@ from django.contrib import auth
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.urlresolvers import reverse_lazy
+from django.core.urlresolvers import reverse, reverse_lazy
 from django.shortcuts import redirect
 from django.utils.encoding import force_text, force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -73,15 +73,17 @@ class SignupView(BasicInfoMixin, CreateView):
 
     def get_email_context(self, user):
         use_https = self.request.is_secure()
+        current_site = get_current_site(self.request)
+        # plain values only, task arguments are sent as JSON
         return {
             'protocol': 'https' if use_https else 'http',
             'email': user.email,
-            'current_site': get_current_site(self.request),
-            'token_url': reverse_lazy('account_confirm', kwargs={
+            'current_site': {'name': current_site.name, 'domain': current_site.domain},
+            'token_url': reverse('account_confirm', kwargs={
                 'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
                 'token': user.token.last().token,
             }),
-            'user': user,
+            'user': {'username': user.username},
             'expiration_days': settings.ACCOUNT_TOKEN_EXPIRED_DAYS,
         }
 
@@ -175,7 +177,7 @@ class ProfileView(BasicInfoMixin, LoginRequiredMixin, UpdateView):
 
     def get_context_data(self, **kwargs):
         ctx = super(ProfileView, self).get_context_data(**kwargs)
-        ctx['host_set'] = self.get_object().host_set.all()
+        ctx['host_set'] = self.object.host_set.all()
         return ctx
 
 
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alpha.settings')
@@ -9,3 +10,12 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alpha.settings')
 app = Celery('alpha')
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+@celeryd_init.connect
+def configure_worker(sender=None, conf=None, **kwargs):
+    """
+    Apply the CELERY_WORKER_PROFILES entry named after the node, e.g. the
+    one of `deploy` to a worker started with `-n deploy@%h`.
+    """
+    conf.update(getattr(settings, 'CELERY_WORKER_PROFILES', {}).get(sender.split('@')[0], {}))
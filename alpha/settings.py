@@ -9,31 +9,134 @@ https://docs.djangoproject.com/en/1.9/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.9/ref/settings/
 """
+from __future__ import absolute_import
 
 import os
+from datetime import timedelta
+from celery.schedules import crontab
+from kombu import Exchange, Queue
 from django.contrib import messages
 from django.utils.translation import ugettext_lazy as _
 # Celery settings
 import djcelery
 djcelery.setup_loader()
 
-BROKER_URL = 'localhost'
-BROKER_BACKEND = 'redis'
-BROKER_USER = ''
-BROKER_PASSWORD = ''
-
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_CONNECT_RETRY = True
 
-# CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'msgpack', 'yaml']
-# CELERY_TASK_SERIALIZER = 'pickle'
-# CELERY_RESULT_SERIALIZER = 'pickle'
-
-CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
+# tasks take primary keys and plain values, never model instances
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+
+# the outcome of a play is kept in RepoResult and CmdResult, task results
+# are only stored by the tasks that need them (chord headers) and expire
+CELERY_IGNORE_RESULT = True
+CELERY_STORE_ERRORS_EVEN_IF_IGNORED = True
+CELERY_TASK_RESULT_EXPIRES = timedelta(days=1)
+
+# broker and result backend:
+#   redis: production, nothing is polled from or written to the database
+#   database: kombu and djcelery tables of the main database
+#   local: files under CELERY_LOCAL_DIR, a stand-in for running workers
+#          on one machine without any service
+# the default cache is shared by the web and celery processes in every
+# mode, it holds the inventory and search versions and the forks in use,
+# see alpha.utils.ansible_api and tasks.models
+CELERY_MODE = os.getenv('ALPHA_CELERY_MODE', 'redis')
+if CELERY_MODE == 'redis':
+    BROKER_URL = 'redis://%s:%s/1' % (REDIS_HOST, REDIS_PORT)
+    # unacknowledged tasks are given to another worker after this many
+    # seconds, longer than any play since deploys are acknowledged late
+    BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 43200}
+    CELERY_RESULT_BACKEND = 'redis://%s:%s/2' % (REDIS_HOST, REDIS_PORT)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': 'redis://%s:%s/3' % (REDIS_HOST, REDIS_PORT),
+        },
+    }
+elif CELERY_MODE == 'database':
+    BROKER_URL = 'django://'
+    CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
+    # created with `python manage.py createcachetable`
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'alpha_cache',
+        },
+    }
+elif CELERY_MODE == 'local':
+    CELERY_LOCAL_DIR = os.getenv('ALPHA_CELERY_LOCAL_DIR', '/tmp/alpha_celery')
+    for folder in ('broker', 'results', 'cache'):
+        if not os.path.isdir(os.path.join(CELERY_LOCAL_DIR, folder)):
+            os.makedirs(os.path.join(CELERY_LOCAL_DIR, folder))
+    BROKER_URL = 'filesystem://'
+    BROKER_TRANSPORT_OPTIONS = {
+        'data_folder_in': os.path.join(CELERY_LOCAL_DIR, 'broker'),
+        'data_folder_out': os.path.join(CELERY_LOCAL_DIR, 'broker'),
+    }
+    CELERY_RESULT_BACKEND = 'djcelery.backends.cache:CacheBackend'
+    CELERY_CACHE_BACKEND = 'celery_results'
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CELERY_LOCAL_DIR, 'cache'),
+        },
+        'celery_results': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(CELERY_LOCAL_DIR, 'results'),
+        },
+    }
+else:
+    raise ValueError('unknown ALPHA_CELERY_MODE %r' % CELERY_MODE)
 CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
 
+# one queue per kind of workload, so short tasks never wait behind deploys
+CELERY_DEFAULT_QUEUE = 'default'
+CELERY_QUEUES = tuple(Queue(name, Exchange(name), routing_key=name)
+                      for name in ('default', 'mail', 'deploy', 'adhoc', 'facts', 'maintenance'))
+CELERY_ROUTES = {
+    'accounts.tasks.send_email': {'queue': 'mail'},
+    'tasks.tasks.repo_runner': {'queue': 'deploy'},
+    'tasks.tasks.repo_shard_runner': {'queue': 'deploy'},
+    'tasks.tasks.repo_async_poller': {'queue': 'deploy'},
+    'tasks.tasks.cmd_runner': {'queue': 'adhoc'},
+    'inventory.tasks.facts_runner': {'queue': 'facts'},
+    'inventory.tasks.stale_facts_runner': {'queue': 'facts'},
+    'tasks.tasks.results_purger': {'queue': 'maintenance'},
+}
+# settings of the workers, by node name, see alpha.celery.configure_worker
+# and run_celery.sh. Plays hold a worker for minutes: they are taken one
+# at a time and acknowledged once done, short tasks are prefetched.
+CELERY_WORKER_PROFILES = {
+    'mail': {
+        'CELERYD_CONCURRENCY': 4,
+        'CELERYD_PREFETCH_MULTIPLIER': 4,
+    },
+    'deploy': {
+        'CELERYD_CONCURRENCY': 4,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERY_ACKS_LATE': True,
+    },
+    'adhoc': {
+        'CELERYD_CONCURRENCY': 4,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERY_ACKS_LATE': True,
+    },
+    'facts': {
+        'CELERYD_CONCURRENCY': 2,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+        'CELERY_ACKS_LATE': True,
+    },
+    'maintenance': {
+        'CELERYD_CONCURRENCY': 1,
+        'CELERYD_PREFETCH_MULTIPLIER': 1,
+    },
+}
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -71,6 +174,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'alpha.utils.queries.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -213,7 +317,11 @@ MSGS = {
     },
     'task_sent': {
         'level': messages.INFO,
-        'text': _('Task has been running in quene, please wait for a moment and refresh.'),
+        'text': _('Task has been queued, results show up below as the hosts finish.'),
+    },
+    'task_joined': {
+        'level': messages.INFO,
+        'text': _('The same action is already running, its results show up below.'),
     },
 }
 
@@ -225,6 +333,62 @@ EMAIL_HOST_PASSWORD = 's3cret@pass'
 
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 
+# Ansible settings
+ANSIBLE_INVENTORY_BUILDER = 'inventory.dynamic.build_inventory'
+# seconds a worker keeps the inventory built from the database, changes
+# saved through the models are picked up right away, see inventory.signals
+ANSIBLE_INVENTORY_MAX_AGE = 300
+ANSIBLE_RESULT_BATCH_SIZE = 100
+ANSIBLE_RESULT_FLUSH_INTERVAL = 2
+ANSIBLE_SHARD_SIZE = 250
+ANSIBLE_FORKS_BUDGET = None
+ANSIBLE_FORKS_PER_CORE = 20
+ANSIBLE_MAX_FORKS = 100
+ANSIBLE_ASYNC_POLL_INTERVAL = 10
+# seconds after which an unfinished run is taken for a dead worker
+ANSIBLE_RUN_TIMEOUT = 3600
+# seconds between two checks of a repo action waiting for the one before
+ANSIBLE_REPO_RETRY_INTERVAL = 10
+# run events go through redis, the other modes poll the database instead
+ANSIBLE_EVENTS_ENABLED = CELERY_MODE == 'redis'
+ANSIBLE_EVENTS_POLL_INTERVAL = 2
+ANSIBLE_EVENTS_HEARTBEAT = 15
+ANSIBLE_EVENTS_TIMEOUT = 3600
+ANSIBLE_FACT_CACHE = 'jsonfile'
+ANSIBLE_FACT_CACHE_CONNECTION = '/tmp/ansible_facts'
+ANSIBLE_FACT_CACHE_TIMEOUT = 3600
+ANSIBLE_FACT_GATHER_SUBSET = '!all,hardware,network'
+ANSIBLE_FACT_BATCH_SIZE = 500
+ANSIBLE_FACT_MAX_AGE = 86400
+ANSIBLE_FACT_REFRESH_INTERVAL = 3600
+ANSIBLE_FACT_REFRESH_LIMIT = 5000
+ANSIBLE_FACT_SLICE_SIZE = 100
+# days and number of runs kept per kind of run, older ones are rolled up
+# into daily stats and deleted
+ANSIBLE_RESULT_RETENTION = {
+    'repo': {'max_age': 90, 'max_count': 100000},
+    'cmd': {'max_age': 30, 'max_count': 50000},
+}
+ANSIBLE_PURGE_CHUNK_SIZE = 1000
+
+# queries a view may run unless it sets `query_budget`, and how many times
+# a statement may run with other literals, see alpha.utils.queries
+QUERY_BUDGET_ENABLED = DEBUG
+QUERY_BUDGET_DEFAULT = 20
+QUERY_REPEAT_LIMIT = 3
+QUERY_BUDGETS = {}
+
+CELERYBEAT_SCHEDULE = {
+    'refresh-stale-facts': {
+        'task': 'inventory.tasks.stale_facts_runner',
+        'schedule': timedelta(seconds=ANSIBLE_FACT_REFRESH_INTERVAL),
+    },
+    'purge-results': {
+        'task': 'tasks.tasks.results_purger',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -1,9 +1,9 @@
-from .base import add_message, generate_md5, getter, BaseFormHelper, default_token_generator
-from .mixins import BasicInfoMixin, SuperuserRequiredMixin, StaffuserRequiredMixin, JSONView
-from .ansible_api import MyRunner
+from .base import add_message, bulk_update, generate_md5, getter, percentile, BaseFormHelper, default_token_generator
+from .mixins import BasicInfoMixin, KeysetPaginationMixin, SuperuserRequiredMixin, StaffuserRequiredMixin, JSONView
+from .ansible_api import MyRunner, StreamingResultsCollector, inventory_cache
 
 __all__ = [
-    'add_message', 'generate_md5', 'getter', 'BaseFormHelper', 'default_token_generator',
-    'BasicInfoMixin', 'SuperuserRequiredMixin', 'StaffuserRequiredMixin', 'JSONView',
-    'MyRunner',
+    'add_message', 'bulk_update', 'generate_md5', 'getter', 'percentile', 'BaseFormHelper', 'default_token_generator',
+    'BasicInfoMixin', 'KeysetPaginationMixin', 'SuperuserRequiredMixin', 'StaffuserRequiredMixin', 'JSONView',
+    'MyRunner', 'StreamingResultsCollector', 'inventory_cache',
 ]
@@ -1,23 +1,199 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
-from collections import namedtuple
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from .base import getter, percentile
+
+# facts gathered by any run land in this cache, see inventory.facts
+os.environ.setdefault('ANSIBLE_CACHE_PLUGIN', getter('ANSIBLE_FACT_CACHE', 'memory'))
+os.environ.setdefault('ANSIBLE_CACHE_PLUGIN_TIMEOUT', str(getter('ANSIBLE_FACT_CACHE_TIMEOUT', 86400)))
+if getter('ANSIBLE_FACT_CACHE_CONNECTION'):
+    os.environ.setdefault('ANSIBLE_CACHE_PLUGIN_CONNECTION', getter('ANSIBLE_FACT_CACHE_CONNECTION'))
+
+from ansible import constants as C
 from ansible.parsing.dataloader import DataLoader
 from ansible.vars import VariableManager
 from ansible.inventory import Inventory
 from ansible.playbook.play import Play
 from ansible.executor.task_queue_manager import TaskQueueManager
 from ansible.plugins.callback import CallbackBase
+from django.core.cache import cache
+from django.utils.module_loading import import_string
 
 Options = namedtuple('Options', ['listtags', 'listtasks', 'listhosts', 'syntax', 'connection', 'module_path', 'forks', 'remote_user', 'private_key_file',
-                                 'ssh_common_args', 'ssh_extra_args', 'sftp_extra_args', 'scp_extra_args', 'become', 'become_method', 'become_user', 'verbosity', 'check'])
+                                 'ssh_common_args', 'ssh_extra_args', 'sftp_extra_args', 'scp_extra_args', 'become', 'become_method', 'become_user', 'verbosity', 'check', 'timeout'])
+
+TRANSFER_METHODS = {
+    'smart': 'smart',
+    'sftp': False,
+    'scp': True,
+}
+
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_VERSION_KEY = 'ansible_inventory_version'
+FORKS_IN_USE_KEY = 'ansible_forks_in_use:%s' % socket.gethostname()
 
 
 class HostPatternError(BaseException):
     pass
 
 
-class ResultsCollector(CallbackBase):
+class AnsibleContext(object):
+    """
+    Loader, variable manager and inventory built from one inventory source,
+    with host pattern resolution memoized for the lifetime of the context.
+    """
+
+    def __init__(self, loader, variable_manager, inventory, version):
+        self.loader = loader
+        self.variable_manager = variable_manager
+        self.inventory = inventory
+        self.version = version
+        self.built = time.time()
+        self._patterns = {}
+
+    def get_hosts(self, pattern):
+        if pattern not in self._patterns:
+            self._patterns[pattern] = tuple(
+                host.name for host in self.inventory.get_hosts(pattern))
+        return self._patterns[pattern]
+
+
+class InventoryCache(object):
+    """
+    Process-wide cache of ansible contexts keyed by inventory source.
+
+    A context is rebuilt when the source file's mtime changes or when the
+    inventory version stored in the django cache is bumped through
+    `invalidate()` (see `inventory.signals`). The cache is shared by the
+    web and celery processes, so a change saved in one of them reaches the
+    contexts of every other; the version never expires, a process never
+    sees an older version again.
+
+    A context without a source file, such as the inventory built from the
+    database, is also rebuilt once older than `max_age` seconds, so a
+    change no signal reported (a queryset update) is picked up in the end.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._contexts = {}
+        self._active = None
+
+    def get_mtime(self, source):
+        try:
+            return os.stat(source).st_mtime
+        except (OSError, TypeError):
+            return None
+
+    def get_version(self, source):
+        return (self.get_mtime(source), cache.get(INVENTORY_VERSION_KEY, 0))
+
+    def expired(self, context):
+        return (self.max_age is not None and context.version[0] is None and
+                time.time() - context.built > self.max_age)
+
+    def get(self, source, factory):
+        version = self.get_version(source)
+        with self._lock:
+            context = self._contexts.get(source)
+            if context is None or context.version != version or self.expired(context):
+                loader, variable_manager, inventory = factory()
+                context = AnsibleContext(
+                    loader, variable_manager, inventory, version)
+                self._contexts[source] = context
+            if self._active is not context:
+                # ansible keeps a module level pattern cache shared by every
+                # Inventory instance, drop it when switching between sources.
+                context.inventory.clear_pattern_cache()
+                self._active = context
+        return context
+
+    def invalidate(self, source=None):
+        with self._lock:
+            if source is None:
+                self._contexts.clear()
+                cache.add(INVENTORY_VERSION_KEY, 0, None)
+                try:
+                    cache.incr(INVENTORY_VERSION_KEY)
+                except ValueError:
+                    cache.set(INVENTORY_VERSION_KEY, 1)
+            else:
+                self._contexts.pop(source, None)
+            self._active = None
+
+inventory_cache = InventoryCache(max_age=getter('ANSIBLE_INVENTORY_MAX_AGE', 300))
+
+
+def module_duration(result):
+    """
+    Seconds a module reports it ran for in the `delta` of its result, like
+    '0:00:01.503420' for command, shell or script, None when it does not.
+    """
+    try:
+        hours, minutes, seconds = result['delta'].split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (KeyError, AttributeError, ValueError):
+        return None
+
+
+class TimingCallback(CallbackBase):
+    """
+    Records how long each host spent on the tasks of a play and how long
+    the play took.
+
+    A host's task takes what its module reports (see module_duration).
+    Modules that report nothing are timed from the start of the task to
+    their result, ansible 2.2 sends no per-host start event: this is wall
+    time, which includes the wait for a free fork once a play has more
+    hosts than forks, as well as connecting and transferring.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimingCallback, self).__init__(*args, **kwargs)
+        self._play_started = self._task_started = self._play_ended = None
+        self._durations = {}
+
+    def v2_playbook_on_play_start(self, play):
+        self._play_started = self._task_started = time.time()
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_started = time.time()
+
+    def time_result(self, result):
+        self._play_ended = now = time.time()
+        host = result._host.get_name()
+        duration = module_duration(result._result)
+        if duration is None:
+            duration = now - (self._task_started or now)
+        self._durations[host] = self._durations.get(host, 0) + duration
+        return duration
+
+    def host_durations(self):
+        return self._durations
+
+    def timings(self, slowest=10):
+        durations = self._durations.values()
+        return dict(
+            duration=(self._play_ended or 0) - (self._play_started or 0),
+            p50=percentile(durations, 50),
+            p95=percentile(durations, 95),
+            max=percentile(durations, 100),
+            slowest=sorted(self._durations.items(), key=lambda x: -x[1])[:slowest],
+        )
+
+
+class ResultsCollector(TimingCallback):
 
     def __init__(self, *args, **kwargs):
         super(ResultsCollector, self).__init__(*args, **kwargs)
@@ -28,12 +204,15 @@ class ResultsCollector(CallbackBase):
         # self._display.verbosity = 4
 
     def v2_runner_on_unreachable(self, result):
+        self.time_result(result)
         self._host_unreachable[result._host.get_name()] = result
 
     def v2_runner_on_ok(self, result,  *args, **kwargs):
+        self.time_result(result)
         self._host_ok[result._host.get_name()] = result
 
     def v2_runner_on_failed(self, result,  *args, **kwargs):
+        self.time_result(result)
         self._host_failed[result._host.get_name()] = result
 
     def host_unreachable(self):
@@ -45,6 +224,129 @@ class ResultsCollector(CallbackBase):
     def host_failed(self):
         return self._host_failed
 
+    def flush(self):
+        pass
+
+
+class StreamingResultsCollector(TimingCallback):
+    """
+    Turns every runner event into a compact per-host record and hands the
+    records to `sink` in batches while the play is running, only host names
+    are kept in memory.
+
+    `projector(status, result)` builds the record payload from a TaskResult,
+    events it returns None for are skipped. `sink(records)` receives a list
+    of dict(host, status, rc, changed, result, duration).
+    """
+
+    def __init__(self, sink, projector=None, batch_size=100, flush_interval=2, *args, **kwargs):
+        super(StreamingResultsCollector, self).__init__(*args, **kwargs)
+        self.sink = sink
+        self.projector = projector or (lambda status, result: result._result)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushed_at = time.time()
+        self._hosts = dict(ok=[], failed=[], unreachable=[])
+
+    def collect(self, status, result):
+        duration = self.time_result(result)
+        record = self.projector(status, result)
+        if record is None:
+            return
+        host = result._host.get_name()
+        self._hosts[status].append(host)
+        self._buffer.append(dict(
+            host=host,
+            status=status,
+            rc=result._result.get('rc'),
+            changed=bool(result._result.get('changed')),
+            result=record,
+            duration=duration
+        ))
+        if len(self._buffer) >= self.batch_size or time.time() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def v2_runner_on_unreachable(self, result):
+        self.collect('unreachable', result)
+
+    def v2_runner_on_ok(self, result, *args, **kwargs):
+        self.collect('ok', result)
+
+    def v2_runner_on_failed(self, result, *args, **kwargs):
+        self.collect('failed', result)
+
+    def flush(self):
+        if self._buffer:
+            records, self._buffer = self._buffer, []
+            self.sink(records)
+        self._flushed_at = time.time()
+
+    def host_unreachable(self):
+        return self._hosts['unreachable']
+
+    def host_ok(self):
+        return self._hosts['ok']
+
+    def host_failed(self):
+        return self._hosts['failed']
+
+    def summary(self):
+        return dict((status, len(hosts)) for (status, hosts) in self._hosts.items())
+
+
+class ForkScheduler(object):
+    """
+    Picks the number of forks for a play from its host count, the cores of
+    this machine and a fork budget shared by every play running on it.
+
+    Forks in use are counted in the default cache, shared by every worker
+    process of the machine (an atomic INCRBY/DECRBY on redis), the key
+    expires after `timeout` seconds so forks leaked by a killed worker are
+    given back.
+    """
+
+    def __init__(self, budget=None, forks_per_core=20, min_forks=1, max_forks=100, timeout=3600):
+        self.budget = budget or multiprocessing.cpu_count() * forks_per_core
+        self.min_forks = min_forks
+        self.max_forks = max_forks
+        self.timeout = timeout
+
+    def in_use(self):
+        return cache.get(FORKS_IN_USE_KEY, 0)
+
+    def acquire(self, host_count):
+        """
+        Reserve the forks of a play: one per host up to `max_forks`, cut to
+        what is left of the budget but never under `min_forks`. They are
+        added to the count first and the part over the budget is given back
+        after, so plays starting together cannot both take the whole budget.
+        """
+        wanted = max(self.min_forks, min(host_count, self.max_forks))
+        cache.add(FORKS_IN_USE_KEY, 0, self.timeout)
+        try:
+            in_use = cache.incr(FORKS_IN_USE_KEY, wanted)
+        except ValueError:
+            cache.set(FORKS_IN_USE_KEY, wanted, self.timeout)
+            in_use = wanted
+        excess = max(0, min(wanted - self.min_forks, in_use - self.budget))
+        if excess:
+            self.release(excess)
+        return wanted - excess
+
+    def release(self, forks):
+        try:
+            if cache.decr(FORKS_IN_USE_KEY, forks) < 0:
+                cache.set(FORKS_IN_USE_KEY, 0, self.timeout)
+        except ValueError:
+            pass
+
+fork_scheduler = ForkScheduler(
+    budget=getter('ANSIBLE_FORKS_BUDGET'),
+    forks_per_core=getter('ANSIBLE_FORKS_PER_CORE', 20),
+    max_forks=getter('ANSIBLE_MAX_FORKS', 100),
+)
+
 
 class MyRunner(object):
 
@@ -56,8 +358,17 @@ class MyRunner(object):
         self.gather_facts = gather_facts
         self.task_list = task_list
         self.playbook = kwargs.get('playbook', None)
+        self.restriction = kwargs.get('restriction', None)
+        self.play_vars = kwargs.get('play_vars', {})
+        self.control_persist = kwargs.get('control_persist', 60)
+        self.control_path = kwargs.get('control_path', None)
+        self.pipelining = kwargs.get('pipelining', None)
+        self.transfer_method = kwargs.get('transfer_method', None)
+        self.async_timeout = kwargs.get('async_timeout', 0)
         self.inventory_file = kwargs.get(
             'inventory_file', '/etc/ansible/hosts')
+        self.inventory_builder = kwargs.get(
+            'inventory_builder', None if 'inventory_file' in kwargs else getter('ANSIBLE_INVENTORY_BUILDER'))
         self.options = Options(
             listtags=kwargs.get('listtags', False),
             listtasks=kwargs.get('listtasks', False),
@@ -65,10 +376,11 @@ class MyRunner(object):
             syntax=kwargs.get('syntax', False),
             connection=kwargs.get('connection', 'ssh'),
             module_path=kwargs.get('module_path', None),
-            forks=kwargs.get('forks', 100),
+            forks=kwargs.get('forks', None),
             remote_user=kwargs.get('remote_user', 'root'),
             private_key_file=kwargs.get('private_key_file', None),
-            ssh_common_args=kwargs.get('ssh_common_args', None),
+            ssh_common_args=self.get_ssh_common_args(
+                kwargs.get('ssh_common_args', None)),
             ssh_extra_args=kwargs.get('ssh_extra_args', None),
             sftp_extra_args=kwargs.get('sftp_extra_args', None),
             scp_extra_args=kwargs.get('scp_extra_args', None),
@@ -76,18 +388,77 @@ class MyRunner(object):
             become_method=kwargs.get('become_method', 'su'),
             become_user=kwargs.get('become_user', 'root'),
             verbosity=kwargs.get('verbosity', None),
-            check=kwargs.get('check', False)
+            check=kwargs.get('check', False),
+            timeout=kwargs.get('timeout', None)
         )
 
-        self.variable_manager = self.initialize_variable_manager()
-        self.loader = self.initialize_loader()
+        self.context = self.initialize_context()
+        self.variable_manager = self.context.variable_manager
+        self.loader = self.context.loader
         self.passwords = self.initialize_passwords()
-        self.inventory = self.initialize_inventory()
-        for pattern in self.host_list.split(','):
-            if len(self.inventory.get_hosts(pattern)) == 0:
+        self.inventory = self.context.inventory
+        for pattern in self.get_patterns():
+            if len(self.context.get_hosts(pattern)) == 0:
                 raise HostPatternError(
                     'ERROR! Specified hosts \033[91m{}\033[0m options do not match any hosts'.format(pattern))
 
+    def get_patterns(self):
+        return filter(None, self.host_list.split(','))
+
+    def get_hosts(self):
+        if self.restriction is not None:
+            return list(self.restriction)
+        hosts = OrderedDict()
+        for pattern in self.get_patterns():
+            hosts.update((host, None) for host in self.context.get_hosts(pattern))
+        return hosts.keys()
+
+    def get_restricted_hosts(self):
+        """
+        Inventory hosts of the restriction. Hosts removed from the inventory
+        since the restriction was made, e.g. by the time a delayed slice of
+        hosts runs, are left out.
+        """
+        hosts = []
+        for name in self.restriction:
+            host = self.inventory.get_host(name)
+            if host is None:
+                logger.warning('%s: skipping %s, not in the inventory', self.task_name, name)
+            else:
+                hosts.append(host)
+        return hosts
+
+    def get_ssh_common_args(self, ssh_common_args=None):
+        args = []
+        if self.control_persist:
+            args.extend([
+                '-o ControlMaster=auto',
+                '-o ControlPersist=%ss' % self.control_persist,
+            ])
+            if self.control_path:
+                args.append('-o ControlPath=%s' % self.control_path)
+        if ssh_common_args:
+            args.append(ssh_common_args)
+        return ' '.join(args) or None
+
+    def get_play_vars(self):
+        play_vars = {}
+        if self.pipelining is not None:
+            # None leaves it to ansible.cfg and the inventory
+            play_vars['ansible_ssh_pipelining'] = self.pipelining
+        play_vars.update(self.play_vars)
+        return play_vars
+
+    def initialize_context(self):
+        return inventory_cache.get(self.inventory_builder or self.inventory_file, self.create_context)
+
+    def create_context(self):
+        self.variable_manager = self.initialize_variable_manager()
+        self.loader = self.initialize_loader()
+        self.inventory = self.initialize_inventory()
+        self.variable_manager.set_inventory(self.inventory)
+        return self.loader, self.variable_manager, self.inventory
+
     def initialize_variable_manager(self):
         return VariableManager()
 
@@ -98,6 +469,8 @@ class MyRunner(object):
         return dict(vault_pass='secret')
 
     def initialize_inventory(self):
+        if self.inventory_builder:
+            return import_string(self.inventory_builder)(self.loader, self.variable_manager)
         return Inventory(
             loader=self.loader,
             variable_manager=self.variable_manager,
@@ -110,24 +483,31 @@ class MyRunner(object):
                 name=self.task_name,
                 hosts=self.host_list,
                 gather_facts=self.gather_facts,
+                vars=self.get_play_vars(),
                 tasks=self.get_task_list()
             )
         return self.playbook
 
     def get_task_list(self):
         if not self.task_list:
-            return [
-                dict(action=dict(module=self.module_name,
-                                 args=self.module_args))
-            ]
+            task = dict(action=dict(module=self.module_name,
+                                    args=self.module_args))
+            if self.async_timeout:
+                # fire and forget, async_status collects the results later
+                task.update({'async': self.async_timeout, 'poll': 0})
+            return [task]
         return self.task_list
 
-    def run(self):
-        self.variable_manager.set_inventory(self.inventory)
+    def run(self, callback=None):
         play = Play().load(self.create_play_tasks(),
                            variable_manager=self.variable_manager, loader=self.loader)
         tqm = None
-        callback = ResultsCollector()
+        callback = callback or ResultsCollector()
+        scheduled = self.options.forks is None
+        if scheduled:
+            self.options = self.options._replace(
+                forks=fork_scheduler.acquire(len(self.get_hosts())))
+        self.forks = self.options.forks
 
         tqm = TaskQueueManager(
             inventory=self.inventory,
@@ -137,28 +517,45 @@ class MyRunner(object):
             passwords=self.passwords
         )
         tqm._stdout_callback = callback
-        result = tqm.run(play)
+        scp_if_ssh = C.DEFAULT_SCP_IF_SSH
+        try:
+            # ansible 2.2 only reads the file transfer method from its
+            # constants, it is set for this run and the workers it forks.
+            if self.transfer_method is not None:
+                C.DEFAULT_SCP_IF_SSH = TRANSFER_METHODS[self.transfer_method]
+            if self.restriction is not None:
+                self.inventory.restrict_to_hosts(self.get_restricted_hosts())
+            result = tqm.run(play)
+        finally:
+            C.DEFAULT_SCP_IF_SSH = scp_if_ssh
+            self.inventory.remove_restriction()
+            callback.flush()
+            if scheduled:
+                fork_scheduler.release(self.forks)
+                self.options = self.options._replace(forks=None)
 
         return result, callback
 
 
 def gather_facts(result):
-    ansible_facts = result._result['ansible_facts']
+    return host_facts(result._result['ansible_facts'])
+
+
+def host_facts(ansible_facts):
+    default_ipv4 = ansible_facts.get('ansible_default_ipv4', {})
     return dict(
-        hostname=ansible_facts['ansible_hostname'],
-        ipv4_address=ansible_facts['ansible_default_ipv4']['address'],
-        macaddress=ansible_facts['ansible_default_ipv4']['macaddress'],
-        processor=tuple(set(ansible_facts['ansible_processor'])),
-        processor_count=ansible_facts['ansible_processor_vcpus'],
-        product_name=ansible_facts['ansible_product_name'],
-        lsb_desc=ansible_facts['ansible_lsb']['description'],
-        memtotal_mb=ansible_facts['ansible_memtotal_mb'],
-        memfree_mb=ansible_facts['ansible_memfree_mb'],
-        sn=ansible_facts['ansible_product_serial'],
+        hostname=ansible_facts.get('ansible_hostname'),
+        ipv4_address=default_ipv4.get('address'),
+        macaddress=default_ipv4.get('macaddress'),
+        processor=tuple(set(ansible_facts.get('ansible_processor', []))),
+        processor_count=ansible_facts.get('ansible_processor_vcpus'),
+        product_name=ansible_facts.get('ansible_product_name'),
+        lsb_desc=ansible_facts.get('ansible_lsb', {}).get('description'),
+        memtotal_mb=ansible_facts.get('ansible_memtotal_mb'),
+        memfree_mb=ansible_facts.get('ansible_memfree_mb'),
+        sn=ansible_facts.get('ansible_product_serial'),
     )
 
 """
-_, callback = MyRunner('gathers_facts', 'host_pattern', module_name='setup').run()
-for host, result in callback.host_ok.items():
-    Host.objects.filter(hostname__iexact=host).update(**gather_facts(result))
+See inventory.facts.refresh_facts for refreshing Host rows in bulk.
 """
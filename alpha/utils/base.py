@@ -6,6 +6,7 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.core import signing
+from django.db.models import Case, F, Value, When
 from django.utils.six import text_type
 from django.utils.translation import ugettext_lazy as _
 
@@ -28,6 +29,34 @@ def generate_md5(string):
     return md5(string).hexdigest()
 
 
+def percentile(values, p):
+    """
+    Nearest-rank `p`th percentile of `values`, 0 for no values.
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def bulk_update(model, changes, **extra):
+    """
+    Write `changes`, a mapping of pk to {field: value}, with a single UPDATE
+    using one CASE expression per changed field. `extra` is set on every row.
+    """
+    if not changes:
+        return 0
+    fields = set(field for values in changes.values() for field in values)
+    updates = dict(extra)
+    for field in fields:
+        updates[field] = Case(
+            *[When(pk=pk, then=Value(values[field]))
+              for (pk, values) in changes.items() if field in values],
+            default=F(field),
+            output_field=model._meta.get_field(field))
+    return model._default_manager.filter(pk__in=list(changes)).update(**updates)
+
+
 class BaseFormHelper(object):
 
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Local connection that simulates ssh round trips, used by the benchmarks.
+
+Every command or file transfer costs FAKE_CONNECTION_RTT seconds, plus
+FAKE_CONNECTION_HANDSHAKE seconds when no master connection is alive for
+the host. Like ssh's ControlPersist, a master is a file in the control
+directory that stays valid for the ControlPersist found in
+ssh_common_args. Each round trip is logged to TRAFFIC_LOG, one letter per
+trip: 'H' when it needed a handshake, 'R' otherwise.
+"""
+
+import os
+import re
+import tempfile
+import time
+
+from ansible.plugins.connection.local import Connection as LocalConnection
+
+RTT = float(os.environ.get('FAKE_CONNECTION_RTT', 0.05))
+HANDSHAKE = float(os.environ.get('FAKE_CONNECTION_HANDSHAKE', 0.3))
+CONTROL_DIR = os.environ.get(
+    'FAKE_CONNECTION_CONTROL_DIR', os.path.join(tempfile.gettempdir(), 'fake-cp'))
+TRAFFIC_LOG = os.path.join(CONTROL_DIR, 'traffic.log')
+
+
+def read_traffic():
+    try:
+        with open(TRAFFIC_LOG) as f:
+            traffic = f.read()
+    except IOError:
+        traffic = ''
+    return traffic.count('H'), len(traffic)
+
+
+class Connection(LocalConnection):
+
+    transport = 'fake'
+
+    def get_control_persist(self):
+        found = re.search(r'ControlPersist=(\d+)',
+                          self._play_context.ssh_common_args or '')
+        return int(found.group(1)) if found else 0
+
+    def roundtrip(self):
+        persist = self.get_control_persist()
+        master = os.path.join(CONTROL_DIR, self._play_context.remote_addr)
+        try:
+            alive = time.time() - os.stat(master).st_mtime < persist
+        except OSError:
+            alive = False
+        if not os.path.isdir(CONTROL_DIR):
+            os.makedirs(CONTROL_DIR)
+        if alive:
+            os.utime(master, None)
+        else:
+            time.sleep(HANDSHAKE)
+            if persist:
+                open(master, 'w').close()
+        time.sleep(RTT)
+        with open(TRAFFIC_LOG, 'a') as f:
+            f.write('R' if alive else 'H')
+
+    def exec_command(self, cmd, in_data=None, sudoable=True):
+        self.roundtrip()
+        return super(Connection, self).exec_command(cmd, in_data=in_data, sudoable=sudoable)
+
+    def put_file(self, in_path, out_path):
+        self.roundtrip()
+        return super(Connection, self).put_file(in_path, out_path)
+
+    def fetch_file(self, in_path, out_path):
+        self.roundtrip()
+        return super(Connection, self).fetch_file(in_path, out_path)
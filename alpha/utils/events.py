@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+import logging
+import time
+
+import redis
+
+from .base import getter
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'ansible_events:'
+
+_connection = None
+
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        _connection = redis.StrictRedis(host=getter('REDIS_HOST', 'localhost'),
+                                        port=getter('REDIS_PORT', 6379),
+                                        db=getter('REDIS_DB', 0))
+    return _connection
+
+
+def events_enabled():
+    """
+    Whether events go through redis, without it watchers poll the database,
+    see tasks.views.RunEventsView.
+    """
+    return getter('ANSIBLE_EVENTS_ENABLED', True)
+
+
+def publish(channel, event, data):
+    """
+    Push an event to the watchers of `channel`. Nothing is stored, an event
+    nobody listens to is dropped, and a broken event channel never fails
+    the play that publishes to it.
+    """
+    if not events_enabled():
+        return
+    try:
+        get_connection().publish(CHANNEL_PREFIX + channel,
+                                 json.dumps(dict(event=event, data=data)))
+    except redis.RedisError as e:
+        logger.warning('cannot publish %s to %s: %s', event, channel, e)
+
+
+class Subscription(object):
+    """
+    Events published to `channel`, read with a blocking wait on the redis
+    connection. Iterating yields (event, data) pairs, or None every
+    `heartbeat` seconds when nothing happened, and stops after `timeout`
+    seconds.
+    """
+
+    def __init__(self, channel, heartbeat=15, timeout=3600):
+        self.pubsub = get_connection().pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(CHANNEL_PREFIX + channel)
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+
+    def __iter__(self):
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            message = self.pubsub.get_message(timeout=self.heartbeat)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message['data'])
+            yield event['event'], event['data']
+
+    def close(self):
+        self.pubsub.close()
+
+
+def sse(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
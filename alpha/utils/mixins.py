@@ -3,7 +3,10 @@ from __future__ import unicode_literals
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
 from django.views.generic import TemplateView
 
 from .base import getter
@@ -48,6 +51,54 @@ class StaffuserRequiredMixin(UserPassesTestMixin):
         return self.request.user.is_staff
 
 
+class KeysetPaginationMixin(object):
+    """
+    Pages of a ListView, newest `keyset_field` first, walked with a cursor
+    rather than an offset: the `keyset_field` and the pk of the last row of
+    the previous page. A deep page is the same index range scan as the
+    first one, and no COUNT is run.
+    """
+    page_size = 10
+    keyset_field = 'updated'
+    cursor_parameter = 'after'
+
+    def get_cursor(self):
+        try:
+            value, pk = self.request.GET[self.cursor_parameter].split(',', 1)
+            value, pk = parse_datetime(value), self.model._meta.pk.to_python(pk)
+        except (KeyError, ValueError, ValidationError):
+            return None
+        return (value, pk) if value is not None else None
+
+    def make_cursor(self, obj):
+        return '%s,%s' % (getattr(obj, self.keyset_field).isoformat(), obj.pk)
+
+    def paginate_keyset(self, queryset):
+        field = self.keyset_field
+        queryset = queryset.order_by('-%s' % field, '-pk')
+        cursor = self.get_cursor()
+        if cursor is not None:
+            value, pk = cursor
+            queryset = queryset.filter(Q(**{'%s__lt' % field: value}) |
+                                       Q(**{field: value, 'pk__lt': pk}))
+        rows = list(queryset[:self.page_size + 1])
+        next_cursor = self.make_cursor(rows[self.page_size - 1]) if len(rows) > self.page_size else None
+        return rows[:self.page_size], next_cursor
+
+    def get_context_object_name(self, object_list):
+        return self.context_object_name or '%s_list' % self.model._meta.model_name
+
+    def get_context_data(self, **kwargs):
+        object_list, next_cursor = self.paginate_keyset(kwargs.pop('object_list', self.object_list))
+        ctx = super(KeysetPaginationMixin, self).get_context_data(object_list=object_list, **kwargs)
+        ctx.update({
+            'cursor_parameter': self.cursor_parameter,
+            'next_cursor': next_cursor,
+            'is_first_page': self.get_cursor() is None,
+        })
+        return ctx
+
+
 class JSONResponseMixin(object):
 
     def render_to_json_response(self, context, **response_kwargs):
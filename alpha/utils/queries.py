@@ -0,0 +1,126 @@
+from __future__ import unicode_literals
+
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import resolve
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.six.moves.urllib.parse import urlsplit
+
+from .base import getter
+
+logger = logging.getLogger(__name__)
+
+# quoted strings and numbers, the queries of a loop only differ by them
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def query_shape(sql):
+    return LITERALS.sub('?', sql)
+
+
+def get_query_budget(view_func, view_name=None):
+    """
+    Most queries a view may run: the QUERY_BUDGETS entry of its url name,
+    else the `query_budget` attribute of the view, else QUERY_BUDGET_DEFAULT.
+    """
+    budgets = getter('QUERY_BUDGETS', {})
+    if view_name in budgets:
+        return budgets[view_name]
+    view = getattr(view_func, 'view_class', view_func)
+    return getattr(view, 'query_budget', getter('QUERY_BUDGET_DEFAULT', None))
+
+
+class QueryStats(object):
+    """
+    Number and database time of `queries`, the statements run more than
+    once as is (`duplicates`) and the ones run more than `repeat_limit`
+    times with other literals (`repeated`), the mark of an N+1 loop.
+    """
+
+    def __init__(self, queries, repeat_limit=None):
+        if repeat_limit is None:
+            repeat_limit = getter('QUERY_REPEAT_LIMIT', 3)
+        self.count = len(queries)
+        self.time = sum(float(query['time']) for query in queries)
+        self.duplicates = [(sql, count) for (sql, count) in Counter(
+            query['sql'] for query in queries).most_common() if count > 1]
+        self.repeated = [(sql, count) for (sql, count) in Counter(
+            query_shape(query['sql']) for query in queries).most_common() if count > repeat_limit]
+
+    def over(self, budget=None):
+        return (budget is not None and self.count > budget) or bool(self.duplicates or self.repeated)
+
+    def report(self, budget=None):
+        lines = ['%s queries in %.1f ms, budget %s' % (self.count, self.time * 1000, budget)]
+        lines.extend('duplicated %sx: %s' % (count, sql) for (sql, count) in self.duplicates)
+        lines.extend('repeated %sx: %s' % (count, sql) for (sql, count) in self.repeated)
+        return '\n'.join(lines)
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Counts the queries of every request, returned in the X-Query-Count and
+    X-Query-Time (ms) headers, and logs the requests over the budget of
+    their view or running a statement again. Put it first so the queries
+    of the other middlewares are counted too. Only used with
+    QUERY_BUDGET_ENABLED, which defaults to DEBUG.
+    """
+
+    def __init__(self):
+        from django.conf import settings
+        if not getter('QUERY_BUDGET_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request._query_context = CaptureQueriesContext(connection)
+        request._query_context.__enter__()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = get_query_budget(view_func, request.resolver_match.view_name)
+
+    def process_response(self, request, response):
+        context = getattr(request, '_query_context', None)
+        if context is None:
+            return response
+        context.__exit__(None, None, None)
+        stats = QueryStats(context.captured_queries)
+        response['X-Query-Count'] = stats.count
+        response['X-Query-Time'] = '%.1f' % (stats.time * 1000)
+        budget = getattr(request, '_query_budget', None)
+        if stats.over(budget):
+            logger.warning('%s %s: %s', request.method, request.path, stats.report(budget))
+        return response
+
+
+@contextmanager
+def query_budget(budget=None, repeat_limit=None):
+    """
+    Fail a test running more than `budget` queries or a statement again in
+    the block, with the report of its queries:
+
+        with query_budget(5):
+            self.client.get(url)
+    """
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    stats = QueryStats(context.captured_queries, repeat_limit)
+    if stats.over(budget):
+        raise AssertionError(stats.report(budget))
+
+
+def assert_view_budget(client, path, budget=None, **extra):
+    """
+    GET `path` with the test `client` within the budget of its view.
+    """
+    if budget is None:
+        match = resolve(urlsplit(path).path)
+        budget = get_query_budget(match.func, match.view_name)
+    with query_budget(budget):
+        response = client.get(path, **extra)
+        response.close()
+    return response
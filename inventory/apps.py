@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class InventoryConfig(AppConfig):
     name = 'inventory'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,50 @@
+from __future__ import unicode_literals
+
+from ansible.inventory import Inventory
+from ansible.inventory.group import Group
+from ansible.inventory.host import Host as AnsibleHost
+from django.db.models import Prefetch
+
+from .models import UNRUNNABLE_STATUS, Host, Hostgroup
+
+
+def get_host_vars(host):
+    host_vars = {'ansible_port': host.port}
+    if host.ipv4_address:
+        host_vars['ansible_host'] = host.ipv4_address
+    return host_vars
+
+
+def build_inventory(loader, variable_manager):
+    """
+    Build an ansible inventory from runnable `Host` rows and their runnable
+    `Hostgroup`s, the result is cached by `alpha.utils.inventory_cache` and
+    rebuilt in every process whenever `inventory.signals` bumps the
+    inventory version in the shared cache, or after ANSIBLE_INVENTORY_MAX_AGE
+    seconds.
+    """
+    inventory = Inventory(loader=loader,
+                          variable_manager=variable_manager,
+                          host_list=[])
+    all_group = inventory.get_group('all')
+    ungrouped = inventory.get_group('ungrouped')
+    groups = {}
+
+    for hostgroup in Hostgroup.objects.exclude(status__in=UNRUNNABLE_STATUS):
+        group = Group(hostgroup.name)
+        inventory.add_group(group)
+        all_group.add_child_group(group)
+        groups[hostgroup.pk] = group
+
+    hosts = Host.objects.exclude(status__in=UNRUNNABLE_STATUS).prefetch_related(
+        Prefetch('group', queryset=Hostgroup.objects.exclude(status__in=UNRUNNABLE_STATUS).only('pk')))
+    for host in hosts:
+        ansible_host = AnsibleHost(host.hostname, host.port)
+        for (key, value) in get_host_vars(host).items():
+            ansible_host.set_variable(key, value)
+        all_group.add_host(ansible_host)
+        host_groups = [groups[g.pk] for g in host.group.all() if g.pk in groups]
+        for group in host_groups or [ungrouped]:
+            group.add_host(ansible_host)
+
+    return inventory
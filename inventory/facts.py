@@ -0,0 +1,101 @@
+from __future__ import unicode_literals
+
+from ansible.plugins.cache import FactCache
+from django.utils import timezone
+
+from alpha.utils import MyRunner, StreamingResultsCollector, bulk_update, getter, inventory_cache
+from alpha.utils.ansible_api import gather_facts, host_facts
+from .models import Host
+
+# the inventory name is the key of a host, facts never rename it
+FACT_FIELDS = ['ipv4_address', 'macaddress', 'processor', 'processor_count',
+               'product_name', 'lsb_desc', 'memtotal_mb', 'memfree_mb', 'sn']
+
+
+def normalize_facts(facts):
+    values = {}
+    for name in FACT_FIELDS:
+        field = Host._meta.get_field(name)
+        value = facts.get(name)
+        if isinstance(value, (list, tuple)):
+            value = ', '.join(value)
+        value = field.to_python(value)
+        if value is not None and getattr(field, 'max_length', None):
+            value = value[:field.max_length]
+        values[name] = value
+    return values
+
+
+def fact_projector(status, result):
+    if status == 'ok':
+        return normalize_facts(gather_facts(result))
+    return {}
+
+
+class FactSink(object):
+    """
+    Compares gathered facts with the stored Host columns and writes only the
+    changed ones, one SELECT and at most two UPDATEs per batch.
+    """
+
+    def __init__(self):
+        self.refreshed = 0
+        self.changed = 0
+
+    def __call__(self, records):
+        facts = dict((record['host'], record['result'])
+                     for record in records if record['status'] == 'ok')
+        if not facts:
+            return
+        now = timezone.now()
+        changes = {}
+        unchanged = []
+        for host in Host.objects.filter(hostname__in=list(facts)).values('pk', 'hostname', *FACT_FIELDS):
+            delta = dict((field, value) for (field, value) in facts[host['hostname']].items()
+                         if host[field] != value)
+            if delta:
+                changes[host['pk']] = delta
+            else:
+                unchanged.append(host['pk'])
+        bulk_update(Host, changes, update_ts=now)
+        if unchanged:
+            Host.objects.filter(pk__in=unchanged).update(update_ts=now)
+        if any('ipv4_address' in delta for delta in changes.values()):
+            inventory_cache.invalidate()
+        self.refreshed += len(facts)
+        self.changed += len(changes)
+
+
+def refresh_facts(host_list='all', force=False, **kwargs):
+    """
+    Sync Host columns with the facts of the hosts matching `host_list`. A
+    restricted `setup` runs against hosts whose facts are missing or expired
+    in the ansible fact cache, or against every host with `force`.
+    """
+    runner = MyRunner('refresh facts', host_list, 'setup',
+                      'gather_subset=%s' % getter(
+                          'ANSIBLE_FACT_GATHER_SUBSET', '!all,hardware,network'),
+                      **kwargs)
+    hosts = runner.get_hosts()
+    batch_size = getter('ANSIBLE_FACT_BATCH_SIZE', 500)
+    sink = FactSink()
+    cached = []
+    if not force:
+        # facts still fresh in the cache are synced without contacting the host
+        fact_cache = FactCache()
+        cached = [host for host in hosts if host in fact_cache]
+        expired = set(hosts).difference(cached)
+        hosts = [host for host in hosts if host in expired]
+        for i in range(0, len(cached), batch_size):
+            sink([dict(host=host, status='ok', result=normalize_facts(host_facts(fact_cache[host])))
+                  for host in cached[i:i + batch_size]])
+    if hosts:
+        runner.restriction = hosts
+        callback = StreamingResultsCollector(
+            sink=sink,
+            projector=fact_projector,
+            batch_size=batch_size,
+            flush_interval=getter('ANSIBLE_RESULT_FLUSH_INTERVAL', 2))
+        runner.run(callback=callback)
+    return {'hosts': len(hosts) + len(cached), 'cached': len(cached),
+            'refreshed': sink.refreshed, 'changed': sink.changed}
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='facts_ts',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='facts refresh timestamp'),
+        ),
+    ]
@@ -15,6 +15,8 @@ STATUS = (
     (5, _('under maintenance')),
 )
 
+UNRUNNABLE_STATUS = [2, 3, 4, 5]
+
 ENV = (
     (1, _('development')),
     (2, _('production'))
@@ -96,6 +98,8 @@ class Host(GeneralInfo):
         choices=TYPE, default=6, verbose_name=_('machine type'))
     sn = models.CharField(
         max_length=128, blank=True, null=True, verbose_name=_('serial number'))
+    facts_ts = models.DateTimeField(
+        blank=True, null=True, editable=False, db_index=True, verbose_name=_('facts refresh timestamp'))
 
     def __unicode__(self):
         return 'hostname: %s | ipv4_address: %s | owners: %s' % (
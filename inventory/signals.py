@@ -0,0 +1,16 @@
+from __future__ import unicode_literals
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from alpha.utils import inventory_cache
+from .models import Host, Hostgroup
+
+
+@receiver(post_save, sender=Host)
+@receiver(post_save, sender=Hostgroup)
+@receiver(post_delete, sender=Host)
+@receiver(post_delete, sender=Hostgroup)
+@receiver(m2m_changed, sender=Host.group.through)
+def invalidate_inventory(sender, **kwargs):
+    inventory_cache.invalidate()
@@ -0,0 +1,39 @@
+from __future__ import division
+
+import datetime
+from celery.task import task
+from django.db.models import Q
+from django.utils import timezone
+
+from alpha.utils import getter
+from .facts import refresh_facts
+from .models import UNRUNNABLE_STATUS, Host
+
+
+@task
+def facts_runner(host_list='all', force=False, **kwargs):
+    return refresh_facts(host_list, force=force, **kwargs)
+
+
+@task
+def stale_facts_runner():
+    """
+    Refresh the facts of hosts not updated for ANSIBLE_FACT_MAX_AGE seconds,
+    least recently tried first, in slices spread evenly over
+    ANSIBLE_FACT_REFRESH_INTERVAL. Hosts are stamped when their slice is
+    sent, so the unreachable ones go behind the others.
+    """
+    interval = getter('ANSIBLE_FACT_REFRESH_INTERVAL', 3600)
+    slice_size = getter('ANSIBLE_FACT_SLICE_SIZE', 100)
+    stale_before = timezone.now() - datetime.timedelta(
+        seconds=getter('ANSIBLE_FACT_MAX_AGE', 86400))
+    hosts = list(Host.objects.exclude(status__in=UNRUNNABLE_STATUS).filter(
+        Q(update_ts__lt=stale_before) | Q(update_ts__isnull=True)
+    ).order_by('facts_ts', 'update_ts').values_list('hostname', flat=True)[
+        :getter('ANSIBLE_FACT_REFRESH_LIMIT', 5000)])
+    Host.objects.filter(hostname__in=hosts).update(facts_ts=timezone.now())
+    slices = [hosts[i:i + slice_size] for i in range(0, len(hosts), slice_size)]
+    for (i, hosts_slice) in enumerate(slices):
+        facts_runner.apply_async(kwargs={'restriction': hosts_slice},
+                                 countdown=int(i * interval / len(slices)))
+    return len(hosts)
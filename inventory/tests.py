@@ -1,3 +1,191 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
 
-# Create your tests here.
+import datetime
+import os
+import tempfile
+from ansible.parsing.dataloader import DataLoader
+from ansible.vars import VariableManager
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from alpha.utils import MyRunner, inventory_cache
+from alpha.utils.ansible_api import HostPatternError, InventoryCache
+from . import tasks
+from .dynamic import build_inventory
+from .facts import FACT_FIELDS, FactSink, normalize_facts
+from .models import Host, Hostgroup
+
+TEST_SETTINGS = dict(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+
+
+def create_host(hostname, *groups, **fields):
+    host = Host.objects.create(hostname=hostname, sudo_username='root', sudo_password='secret', **fields)
+    host.group.add(*groups)
+    return host
+
+
+class FakeInventory(object):
+
+    def clear_pattern_cache(self):
+        pass
+
+
+class FakeTask(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, args=(), kwargs=None, **options):
+        self.calls.append((args, kwargs, options))
+
+
+@override_settings(**TEST_SETTINGS)
+class InventoryCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.built = []
+
+    def factory(self):
+        self.built.append(FakeInventory())
+        return None, None, self.built[-1]
+
+    def test_reused_until_invalidated(self):
+        inventory_cache = InventoryCache()
+        context = inventory_cache.get('builder', self.factory)
+        self.assertIs(inventory_cache.get('builder', self.factory), context)
+        inventory_cache.invalidate()
+        self.assertIsNot(inventory_cache.get('builder', self.factory), context)
+        self.assertEqual(len(self.built), 2)
+
+    def test_invalidated_in_every_process(self):
+        # two caches stand for the contexts of two processes
+        web, worker = InventoryCache(), InventoryCache()
+        context = worker.get('builder', self.factory)
+        web.invalidate()
+        self.assertIsNot(worker.get('builder', self.factory), context)
+
+    def test_source_file_changed(self):
+        inventory_cache = InventoryCache()
+        with tempfile.NamedTemporaryFile() as source:
+            context = inventory_cache.get(source.name, self.factory)
+            self.assertIs(inventory_cache.get(source.name, self.factory), context)
+            os.utime(source.name, (0, 0))
+            self.assertIsNot(inventory_cache.get(source.name, self.factory), context)
+
+    def test_max_age(self):
+        inventory_cache = InventoryCache(max_age=60)
+        context = inventory_cache.get('builder', self.factory)
+        self.assertIs(inventory_cache.get('builder', self.factory), context)
+        context.built -= 120
+        self.assertIsNot(inventory_cache.get('builder', self.factory), context)
+
+
+@override_settings(**TEST_SETTINGS)
+class DynamicInventoryTests(TestCase):
+
+    def setUp(self):
+        self.web = Hostgroup.objects.create(name='web')
+        self.db = Hostgroup.objects.create(name='db')
+        self.retired = Hostgroup.objects.create(name='retired', status=4)
+        create_host('web1', self.web, ipv4_address='10.0.0.1', port=2222)
+        create_host('web2', self.web, self.retired)
+        create_host('db1', self.db)
+        create_host('lonely')
+        create_host('broken', self.web, status=2)
+
+    def get_names(self, inventory, pattern):
+        return sorted(host.name for host in inventory.get_hosts(pattern))
+
+    def test_build_inventory(self):
+        inventory = build_inventory(DataLoader(), VariableManager())
+        self.assertEqual(self.get_names(inventory, 'all'), ['db1', 'lonely', 'web1', 'web2'])
+        self.assertEqual(self.get_names(inventory, 'web'), ['web1', 'web2'])
+        self.assertEqual(self.get_names(inventory, 'ungrouped'), ['lonely'])
+        self.assertEqual(self.get_names(inventory, 'retired'), [])
+        host_vars = inventory.get_host('web1').get_vars()
+        self.assertEqual((host_vars['ansible_host'], host_vars['ansible_port']), ('10.0.0.1', 2222))
+
+    def test_changes_reach_runners(self):
+        self.assertEqual(sorted(MyRunner('test', 'web', 'ping').get_hosts()), ['web1', 'web2'])
+        with self.assertRaises(HostPatternError):
+            MyRunner('test', 'new1', 'ping')
+        create_host('new1', self.web)
+        Host.objects.filter(hostname='web2').get().delete()
+        self.assertEqual(MyRunner('test', 'new1', 'ping').get_hosts(), ['new1'])
+        self.assertEqual(sorted(MyRunner('test', 'web', 'ping').get_hosts()), ['new1', 'web1'])
+
+
+@override_settings(**TEST_SETTINGS)
+class FactSinkTests(TestCase):
+
+    def setUp(self):
+        self.facts = dict(ipv4_address='10.0.0.1', macaddress='52:54:00:00:00:01', processor='Xeon',
+                          processor_count=4, product_name='KVM', lsb_desc='Debian 8', memtotal_mb=2048,
+                          memfree_mb=1024, sn='0001')
+        self.web1 = create_host('web1', **self.facts)
+        self.web2 = create_host('web2', **self.facts)
+
+    def sink(self, sink, **results):
+        sink([dict(host=host, status='ok', result=normalize_facts(facts))
+              for (host, facts) in sorted(results.items())])
+
+    def get_facts(self, hostname):
+        return Host.objects.filter(hostname=hostname).values(*FACT_FIELDS).get()
+
+    def test_only_changes_are_written(self):
+        sink = FactSink()
+        self.sink(sink, web1=dict(self.facts, memfree_mb=512, processor=['Xeon', 'Xeon']), web2=self.facts)
+        self.assertEqual((sink.refreshed, sink.changed), (2, 1))
+        self.assertEqual(self.get_facts('web1'), dict(self.facts, memfree_mb=512, processor='Xeon, Xeon'))
+        self.assertEqual(self.get_facts('web2'), self.facts)
+        for host in (self.web1, self.web2):
+            self.assertGreater(Host.objects.get(pk=host.pk).update_ts, host.update_ts)
+
+    def test_failed_hosts_are_left_alone(self):
+        sink = FactSink()
+        sink([dict(host='web1', status='unreachable', result={})])
+        self.assertEqual((sink.refreshed, sink.changed), (0, 0))
+        self.assertEqual(Host.objects.get(pk=self.web1.pk).update_ts, self.web1.update_ts)
+
+    def test_address_change_invalidates_inventory(self):
+        factory = lambda: (None, None, FakeInventory())
+        context = inventory_cache.get('builder', factory)
+        self.sink(FactSink(), web1=dict(self.facts, memfree_mb=512))
+        self.assertIs(inventory_cache.get('builder', factory), context)
+        self.sink(FactSink(), web1=dict(self.facts, ipv4_address='10.0.0.2'))
+        self.assertIsNot(inventory_cache.get('builder', factory), context)
+
+
+@override_settings(ANSIBLE_FACT_MAX_AGE=3600, ANSIBLE_FACT_REFRESH_INTERVAL=60, ANSIBLE_FACT_SLICE_SIZE=2,
+                   **TEST_SETTINGS)
+class StaleFactsTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        for (age, hostname) in enumerate(['fresh', 'old', 'older', 'oldest']):
+            create_host(hostname)
+            Host.objects.filter(hostname=hostname).update(update_ts=now - datetime.timedelta(hours=age * 2))
+        create_host('broken', status=2)
+        self.facts_runner = FakeTask()
+        self.addCleanup(setattr, tasks, 'facts_runner', tasks.facts_runner)
+        tasks.facts_runner = self.facts_runner
+
+    def get_slices(self):
+        slices = [(kwargs['restriction'], options['countdown']) for (_, kwargs, options) in self.facts_runner.calls]
+        self.facts_runner.calls = []
+        return slices
+
+    def test_slices(self):
+        self.assertEqual(tasks.stale_facts_runner(), 3)
+        self.assertEqual(self.get_slices(), [(['oldest', 'older'], 0), (['old'], 30)])
+
+    @override_settings(ANSIBLE_FACT_REFRESH_LIMIT=2)
+    def test_unreachable_hosts_rotate(self):
+        # the facts of the hosts never come back, they stay stale
+        self.assertEqual(tasks.stale_facts_runner(), 2)
+        self.assertEqual(self.get_slices(), [(['oldest', 'older'], 0)])
+        self.assertEqual(tasks.stale_facts_runner(), 2)
+        self.assertEqual(self.get_slices(), [(['old', 'oldest'], 0)])
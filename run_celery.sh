@@ -0,0 +1,13 @@
+#!/bin/sh
+# Starts one worker per queue, see CELERY_QUEUES and CELERY_WORKER_PROFILES
+# in alpha/settings.py for the routing and the settings of each of them.
+# The mail worker also takes the default queue: short housekeeping tasks,
+# long ones such as purging old results go to the maintenance worker.
+# PYTHONOPTIMIZE lets ansible fork from the daemonic pool processes.
+cd /vagrant/alpha/
+export PYTHONOPTIMIZE=1
+celery multi ${1:-start} mail deploy adhoc facts maintenance -A alpha -l info -Ofair \
+    -Q:mail mail,default -Q:deploy deploy -Q:adhoc adhoc -Q:facts facts \
+    -Q:maintenance maintenance \
+    --pidfile=/tmp/alpha.celery_%n.pid --logfile=/tmp/alpha.celery_%n.log
+celery beat -A alpha --detach --pidfile=/tmp/alpha.celerybeat.pid --logfile=/tmp/alpha.celerybeat.log
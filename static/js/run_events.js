@@ -0,0 +1,64 @@
+/*
+ * Fills a host result table from the server-sent events of a run,
+ * see tasks.views.RunEventsView. With `follow` the table is reset for every
+ * new run on the channel, otherwise the stream is closed once the run is
+ * finished. Outputs are fetched from `outputUrl`, with DIGEST replaced,
+ * when a row is opened.
+ */
+function watchRun(url, outputUrl, table, progress, follow, hostCount) {
+    var runId = null, seen = {};
+
+    function reset(run) {
+        runId = run;
+        seen = {};
+        $(table).find('tbody').empty();
+    }
+
+    function showProgress(text) {
+        $(progress).text(text);
+    }
+
+    function addHosts(data) {
+        if (data.run !== runId) {
+            reset(data.run);
+        }
+        $.each(data.hosts, function (i, host) {
+            if (seen[host.host]) {
+                return;
+            }
+            seen[host.host] = true;
+            var output = $('<td>').append($('<a href="#">').text('show').one('click', function () {
+                $.getJSON(outputUrl.replace('DIGEST', host.output), function (data) {
+                    var text = typeof data.output === 'string' ? data.output : JSON.stringify(data.output, null, 2);
+                    output.empty().append($('<pre>').text(text));
+                });
+                return false;
+            }));
+            $('<tr>').addClass(host.status === 'ok' ? '' : 'danger').append(
+                $('<td>').text(host.host),
+                $('<td>').text(host.status),
+                $('<td>').text(host.rc === null ? '' : host.rc),
+                $('<td>').text(host.duration.toFixed(2)),
+                output
+            ).appendTo($(table).find('tbody'));
+        });
+        var count = Object.keys(seen).length;
+        showProgress(hostCount ? count + ' / ' + hostCount : count);
+    }
+
+    var source = new EventSource(url);
+    source.addEventListener('hosts', function (e) {
+        addHosts(JSON.parse(e.data));
+    });
+    source.addEventListener('finished', function (e) {
+        var data = JSON.parse(e.data);
+        if (data.run !== runId) {
+            reset(data.run);
+        }
+        showProgress($(progress).text() + ' (' + data.ret_code + ')');
+        if (!follow) {
+            source.close();
+        }
+    });
+    return source;
+}
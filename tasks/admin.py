@@ -1,6 +1,14 @@
 from django.contrib import admin
 
-from .models import RunnerOption, Repo
+from .models import RunnerOption, Repo, RepoResult, CmdResult
+
+
+class ResultAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'ret_code', 'forks', 'duration',
+                    'host_p50', 'host_p95', 'host_max', 'created')
+    readonly_fields = ('slowest_hosts',)
 
 admin.site.register(RunnerOption)
 admin.site.register(Repo)
+admin.site.register(RepoResult, ResultAdmin)
+admin.site.register(CmdResult, ResultAdmin)
@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class TasksConfig(AppConfig):
     name = 'tasks'
+
+    def ready(self):
+        from . import signals
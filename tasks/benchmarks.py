@@ -0,0 +1,354 @@
+"""
+Offline benchmarks of the ansible execution path, run them with
+`python manage.py benchmark <suite>`. Hosts are synthetic and reached
+through the `fake` connection plugin, see alpha/utils/connection_plugins.
+"""
+import copy
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from ansible.plugins import connection_loader
+from kombu import Connection
+from kombu.serialization import disable_insecure_serializers, enable_insecure_serializers
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from alpha.utils import MyRunner, inventory_cache, percentile
+from alpha.utils.connection_plugins import fake
+from .forms import RepoActionForm
+from .models import CmdResult, CmdHostResult, Repo, RepoResult, RepoHostResult, RunnerOption
+from .tasks import cmd_projector, play_results, repo_projector, s_results
+
+FAKE_CONNECTION_PLUGINS = os.path.join(
+    settings.BASE_DIR, 'alpha', 'utils', 'connection_plugins')
+
+
+def fake_inventory(host_count):
+    return ','.join('fake%04d' % i for i in range(host_count)) + ','
+
+
+def fake_runner(host_count, module_name='command', module_args='true', **kwargs):
+    connection_loader.add_directory(FAKE_CONNECTION_PLUGINS)
+    kwargs.setdefault('forks', host_count)
+    play_vars = {'ansible_python_interpreter': sys.executable}
+    play_vars.update(kwargs.pop('play_vars', {}))
+    return MyRunner('benchmark', 'all', module_name, module_args,
+                    inventory_file=fake_inventory(host_count),
+                    connection='fake',
+                    become=False,
+                    become_method='sudo',
+                    play_vars=play_vars,
+                    **kwargs)
+
+
+def reset_fake_connections():
+    shutil.rmtree(fake.CONTROL_DIR, ignore_errors=True)
+
+
+CONNECTION_PROFILES = [
+    ('no multiplexing', dict(control_persist=0)),
+    ('ControlPersist', dict(control_persist=600)),
+    ('ControlPersist + pipelining', dict(control_persist=600, pipelining=True)),
+]
+
+
+def bench_connection(hosts=10, rounds=3, **kwargs):
+    """
+    Per-task cost of each connection profile. The first round pays for the
+    handshakes, later rounds reuse the persisted master connections.
+    Network time is what the simulated round trips cost, independent of
+    how fast this machine runs the modules.
+    """
+    for (name, profile) in CONNECTION_PROFILES:
+        reset_fake_connections()
+        timings = []
+        for _ in range(rounds):
+            runner = fake_runner(hosts, **profile)
+            start = time.time()
+            ret_code, _ = runner.run()
+            timings.append(time.time() - start)
+        handshakes, trips = fake.read_traffic()
+        tasks = hosts * rounds
+        yield OrderedDict([
+            ('profile', name),
+            ('hosts', hosts),
+            ('handshakes/task', float(handshakes) / tasks),
+            ('round trips/task', float(trips) / tasks),
+            ('network s/task', (handshakes * fake.HANDSHAKE + trips * fake.RTT) / tasks),
+            ('first round (s)', timings[0]),
+            ('next rounds (s)', sum(timings[1:]) / max(len(timings) - 1, 1)),
+            ('ret_code', ret_code),
+        ])
+
+
+def peak_rss():
+    """
+    High-water RSS in MB of this process and of the largest reaped fork.
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0)
+
+
+def timed_projector(func, arrivals):
+    def projector(status, result):
+        arrivals.append(time.time())
+        return func(status, result)
+    return projector
+
+
+def adhoc_run(runner, arrivals, user, repo):
+    """
+    What cmd_runner does: stream host outputs into CmdHostResult while
+    the play runs.
+    """
+    run = CmdResult.objects.create(cmd=runner.module_args, executor=user)
+    run, _ = play_results(runner,
+                          func=timed_projector(cmd_projector, arrivals),
+                          host_model=CmdHostResult,
+                          run=run)
+    return run.ret_code
+
+
+def repo_run(runner, arrivals, user, repo):
+    """
+    What repo_runner does for a single shard: stream host results into
+    RepoHostResult while the play runs.
+    """
+    run, _ = s_results(runner,
+                       func=timed_projector(repo_projector, arrivals),
+                       model=RepoResult,
+                       host_model=RepoHostResult,
+                       repo=repo,
+                       executor=user)
+    return run.ret_code
+
+
+EXECUTION_PATHS = [
+    ('adhoc', adhoc_run),
+    ('repo', repo_run),
+]
+
+
+def bench_execution(hosts=10, rounds=3, **kwargs):
+    """
+    Cost of the ad-hoc and the repo execution paths for `hosts` synthetic
+    hosts, averaged over `rounds` runs. Setup is building the runner from
+    a cold inventory cache, host latency is measured from the start of the play to the arrival of
+    each host's result. Database rows are rolled back afterwards.
+    """
+    for (name, execute) in EXECUTION_PATHS:
+        setups, walls, latencies, writes = [], [], [], []
+        for _ in range(rounds):
+            reset_fake_connections()
+            arrivals = []
+            with transaction.atomic():
+                user = User.objects.create(username='__benchmark__', email='benchmark@localhost')
+                opts = RunnerOption.objects.create(name='benchmark', module_name='command')
+                repo = Repo.objects.create(name='benchmark', author=user, url='benchmark',
+                                           username='benchmark', password='benchmark',
+                                           revision='0', dest='/tmp/benchmark', opts=opts)
+                inventory_cache.invalidate()
+                start = time.time()
+                runner = fake_runner(hosts, **kwargs)
+                started = time.time()
+                with CaptureQueriesContext(connection) as queries:
+                    ret_code = execute(runner, arrivals, user, repo)
+                walls.append(time.time() - start)
+                transaction.set_rollback(True)
+            setups.append(started - start)
+            latencies.extend(t - started for t in arrivals)
+            writes.append(len([q for q in queries.captured_queries
+                               if not q['sql'].lstrip().upper().startswith('SELECT')]))
+        rss, fork_rss = peak_rss()
+        yield OrderedDict([
+            ('path', name),
+            ('hosts', hosts),
+            ('setup (s)', sum(setups) / rounds),
+            ('host p50 (s)', percentile(latencies, 50)),
+            ('host p95 (s)', percentile(latencies, 95)),
+            ('host max (s)', percentile(latencies, 100)),
+            ('wall (s)', sum(walls) / rounds),
+            ('peak rss (MB)', rss),
+            ('fork rss (MB)', fork_rss),
+            ('db writes', sum(writes) / rounds),
+            ('ret_code', ret_code),
+        ])
+
+
+def deepcopy_projector(status, result):
+    """
+    How results were post-processed before tasks.project().
+    """
+    copied = copy.deepcopy(result._result)
+    copied.pop('invocation', None)
+    return copied
+
+
+PROJECTORS = [
+    ('deepcopy', deepcopy_projector),
+    ('projection', repo_projector),
+]
+
+
+class FakeResult(object):
+
+    def __init__(self, result):
+        self._result = result
+
+
+def large_result(i, lines=500):
+    """
+    A subversion update result carrying a long log, the way ansible hands
+    it to the callback.
+    """
+    log = '\n'.join('A    /srv/app/module%d/file%d.py' % (i, n) for n in range(lines))
+    return {
+        'changed': True,
+        'before': ['Revision: %d' % i, 'URL: svn://svn.example.com/app'],
+        'after': ['Revision: %d' % (i + 1), 'URL: svn://svn.example.com/app'],
+        'stdout': log,
+        'stdout_lines': log.splitlines(),
+        'invocation': {'module_name': 'subversion', 'module_args': {
+            'repo': 'svn://svn.example.com/app', 'dest': '/srv/app', 'revision': 'HEAD',
+            'username': 'deploy', 'password': 'VALUE_SPECIFIED_IN_NO_LOG_PARAMETER',
+            'force': False, 'export': False, 'switch': True}},
+        '_ansible_parsed': True,
+        '_ansible_no_log': False,
+    }
+
+
+def measure_projection(projector, count, queue):
+    results = [FakeResult(large_result(i)) for i in range(count)]
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    records = [projector('ok', result) for result in results]
+    projected = time.time()
+    stored = sum(len(json.dumps(record)) for record in records)
+    queue.put((projected - start, time.time() - projected,
+               (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024.0, stored))
+
+
+def bench_projection(hosts=1000, rounds=3, **kwargs):
+    """
+    Post-processing of `hosts` large module results by each projector,
+    every round in a fresh process so peak memory is not shared. Extra RSS
+    is the peak growth while projecting, on top of the results themselves.
+    """
+    for (name, projector) in PROJECTORS:
+        samples = []
+        for _ in range(rounds):
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=measure_projection,
+                                              args=(projector, hosts, queue))
+            process.start()
+            samples.append(queue.get())
+            process.join()
+        yield OrderedDict([
+            ('projector', name),
+            ('results', hosts),
+            ('project (s)', sum(s[0] for s in samples) / rounds),
+            ('serialize (s)', sum(s[1] for s in samples) / rounds),
+            ('extra rss (MB)', max(s[2] for s in samples)),
+            ('stored (MB)', samples[0][3] / 1024.0 / 1024.0),
+        ])
+
+
+def pickled_instances(run, runner_kwargs):
+    """
+    How repo_runner was sent before it took primary keys: the user and the
+    repo instances, with the relations the form had loaded, pickled.
+    """
+    return 'pickle', (run.executor, run.repo), runner_kwargs
+
+
+def json_primary_keys(run, runner_kwargs):
+    return 'json', (run.pk,), runner_kwargs
+
+
+PAYLOADS = [
+    ('pickle, instances', pickled_instances),
+    ('json, primary keys', json_primary_keys),
+]
+
+# in-process broker for the serialization cost alone, and the database
+# broker when it is installed
+TRANSPORTS = ['memory://'] + (['django://'] if 'kombu.transport.django' in settings.INSTALLED_APPS else [])
+
+
+def repo_action(hosts):
+    user = User.objects.create(username='__benchmark__', email='benchmark@localhost')
+    opts = RunnerOption.objects.create(name='benchmark', module_name='subversion')
+    repo = Repo.objects.create(name='benchmark', author=user, url='benchmark',
+                               username='benchmark', password='benchmark',
+                               revision='0', dest='/tmp/benchmark', opts=opts)
+    repo = Repo.objects.select_related('author', 'opts').get(pk=repo.pk)
+    form = RepoActionForm(user, repo, data={'revision': 1})
+    form.is_valid()
+    runner_kwargs = form.get_runner_kwargs(repo)
+    runner_kwargs['host_list'] = fake_inventory(hosts)
+    run = RepoResult.objects.create(repo=repo, executor=user)
+    return run, runner_kwargs
+
+
+def bench_broker(hosts=10, rounds=3, messages=500, **kwargs):
+    """
+    Throughput of `messages` repo_runner messages for `hosts` hosts through
+    each transport, enqueued then dequeued and decoded, before and after
+    tasks took primary keys. Database rows are rolled back afterwards.
+    """
+    # the workers refuse pickle now, the benchmark reads it back anyway
+    enable_insecure_serializers(['pickle'])
+    try:
+        for row in broker_rows(hosts, rounds, messages):
+            yield row
+    finally:
+        disable_insecure_serializers(settings.CELERY_ACCEPT_CONTENT)
+
+
+def broker_rows(hosts, rounds, messages):
+    for transport in TRANSPORTS:
+        for (name, payload) in PAYLOADS:
+            enqueues, dequeues = [], []
+            with transaction.atomic():
+                serializer, args, runner_kwargs = payload(*repo_action(hosts))
+                for _ in range(rounds):
+                    with Connection(transport) as conn:
+                        queue = conn.SimpleQueue('benchmark', serializer=serializer)
+                        start = time.time()
+                        for _ in range(messages):
+                            queue.put(dict(task='tasks.tasks.repo_runner', id=str(uuid.uuid4()),
+                                           args=args, kwargs=runner_kwargs))
+                        enqueued = time.time()
+                        for _ in range(messages):
+                            message = queue.get(timeout=10)
+                            size = len(message.body)
+                            message.payload
+                            message.ack()
+                        enqueues.append(enqueued - start)
+                        dequeues.append(time.time() - enqueued)
+                        queue.close()
+                transaction.set_rollback(True)
+            yield OrderedDict([
+                ('transport', transport),
+                ('payload', name),
+                ('hosts', hosts),
+                ('message (bytes)', size),
+                ('enqueue (msg/s)', messages * rounds / sum(enqueues)),
+                ('dequeue (msg/s)', messages * rounds / sum(dequeues)),
+            ])
+
+
+SUITES = {
+    'broker': bench_broker,
+    'connection': bench_connection,
+    'execution': bench_execution,
+    'projection': bench_projection,
+}
@@ -1,15 +1,27 @@
 from __future__ import unicode_literals
 
+import json
 import re
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Reset, Submit
 from django import forms
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 
-from alpha.utils import BaseFormHelper, MyRunner
-from inventory.models import Host
-from .models import RunnerOption, Repo
-from .tasks import repo_runner
+from alpha.utils import BaseFormHelper, generate_md5
+from inventory.models import UNRUNNABLE_STATUS, Host
+from .models import RunnerOption, Repo, RepoResult, CmdResult
+from .tasks import cmd_runner, fail_run, repo_runner
+
+
+def cache_choices(field, *related):
+    """
+    Render the choices of a model choice `field` from a single evaluation of
+    its queryset with `related` prefetched. Django iterates the queryset
+    again for every rendering, without prefetching what labels use.
+    """
+    field.choices = [(obj.pk, field.label_from_instance(obj))
+                     for obj in field.queryset.prefetch_related(*related)]
 
 
 class RepoForm(BaseFormHelper, forms.ModelForm):
@@ -30,6 +42,8 @@ class RepoForm(BaseFormHelper, forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(RepoForm, self).__init__(*args, **kwargs)
+        # host labels list their owners
+        cache_choices(self.fields['hosts'], 'owner')
         self.helper.add_input(Submit('submit', _('Submit')))
         self.helper.add_input(Reset('reset', _('Reset')))
 
@@ -49,6 +63,8 @@ class RepoActionForm(BaseFormHelper, forms.Form):
                                   min_value=0,
                                   help_text=_('If left blank, action will be <code>UPDATE</code> to latest revision, \
                                else will be <code>ROLLBACK</code> to specified revision.'))
+    force = forms.BooleanField(label=_('Run on every host'), required=False,
+                               help_text=_('Also run on the hosts already at the specified revision.'))
 
     def __init__(self, user, repo, *args, **kwargs):
         self.user = user
@@ -64,32 +80,67 @@ class RepoActionForm(BaseFormHelper, forms.Form):
         else:
             revision_opts = 'revision=%s' % revision
         runner_kwargs = {
-            'task_name': _('action of %s' % obj.pk),
-            'host_list': ','.join(host.hostname for host in obj.hosts.exclude(status__in=[2, 3, 4, 5])) + ',' + ','.join(hostgroup.name for hostgroup in obj.hostgroups.exclude(status__in=[2, 3, 4, 5])),
+            'task_name': 'action of %s' % obj.pk,
+            'host_list': ','.join(host.hostname for host in obj.hosts.exclude(status__in=UNRUNNABLE_STATUS)) + ',' + ','.join(hostgroup.name for hostgroup in obj.hostgroups.exclude(status__in=UNRUNNABLE_STATUS)),
             'module_name': obj.opts.module_name,
             'module_args': 'repo={0} dest={1} username={2} password={3} {4}'.format(
                 obj.url, obj.dest, obj.username, obj.password, revision_opts),
             'remote_user': obj.opts.remote_user,
             'become_method': obj.opts.get_become_method_display(),
             'become_user': obj.opts.become_user,
+            'async_timeout': obj.opts.async_timeout,
+            'revision': str(revision) if revision_opts else None,
+            'force': self.cleaned_data['force'],
         }
+        runner_kwargs.update(obj.opts.get_connection_kwargs())
+        runner_kwargs.update(obj.opts.get_rolling_kwargs())
         return runner_kwargs
 
+    def get_action(self, runner_kwargs):
+        """
+        Digest telling identical actions apart: same revision and same hosts.
+        """
+        hosts = sorted(set(filter(None, runner_kwargs['host_list'].split(','))))
+        return generate_md5(json.dumps([runner_kwargs['revision'], runner_kwargs['force'], hosts]))
+
     def save(self):
+        """
+        Queue the action and return its run along with whether it was
+        created. An identical action not finished yet is returned instead
+        of queuing another one.
+        """
         runner_kwargs = self.get_runner_kwargs(self.repo)
-        play_return = repo_runner.delay(self.user, self.repo, **runner_kwargs)
-        return play_return
+        action = self.get_action(runner_kwargs)
+        with transaction.atomic():
+            # submissions for the repo wait for each other here
+            list(Repo.objects.select_for_update().filter(pk=self.repo.pk))
+            run = RepoResult.objects.in_flight().filter(repo=self.repo, action=action).first()
+            if run is not None:
+                return run, False
+            run = RepoResult.objects.create(repo=self.repo, executor=self.user, action=action)
+            # the worker must find the run, so it is queued once committed
+            transaction.on_commit(lambda: self.enqueue(run, runner_kwargs))
+        return run, True
+
+    def enqueue(self, run, runner_kwargs):
+        try:
+            repo_runner.delay(run.pk, **runner_kwargs)
+        except:
+            # a run never queued would hold back the next actions of the repo
+            fail_run(run)
+            raise
 
 
 class CmdForm(BaseFormHelper, forms.Form):
     cmd = forms.CharField(label=_('Shell or Command'))
     host = forms.ModelMultipleChoiceField(
-        queryset=Host.objects.exclude(status__in=[2, 3, 4, 5]),
+        queryset=Host.objects.exclude(status__in=UNRUNNABLE_STATUS),
         widget=forms.CheckboxSelectMultiple)
 
     def __init__(self, user, *args, **kwargs):
         self.user = user
         super(CmdForm, self).__init__(*args, **kwargs)
+        cache_choices(self.fields['host'], 'owner')
         self.helper.add_input(Submit('submit', _('Go!')))
         self.opts = RunnerOption.objects.filter(module_name='shell').last()
 
@@ -115,9 +166,13 @@ class CmdForm(BaseFormHelper, forms.Form):
             'become_method': self.opts.get_become_method_display(),
             'become_user': self.opts.become_user,
         }
+        runner_kwargs.update(self.opts.get_connection_kwargs())
         return runner_kwargs
 
     def save(self):
         runner_kwargs = self.get_runner_kwargs()
-        play_return = MyRunner(**runner_kwargs).run()
-        return play_return
+        run = CmdResult.objects.create(cmd=self.cleaned_data['cmd'],
+                                       executor=self.user,
+                                       host_count=len(self.cleaned_data['host']))
+        cmd_runner.delay(run.pk, **runner_kwargs)
+        return run
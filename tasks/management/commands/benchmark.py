@@ -0,0 +1,34 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.benchmarks import SUITES
+
+
+class Command(BaseCommand):
+    help = 'Run an offline benchmark suite of the ansible execution path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=sorted(SUITES))
+        parser.add_argument('--hosts', type=int,
+                            help='hosts per round, the default of the suite when left out')
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--json', action='store_true',
+                            help='print one JSON object per row, for diffing reports')
+
+    def handle(self, *args, **options):
+        suite = SUITES[options['suite']]
+        kwargs = dict(rounds=options['rounds'])
+        if options['hosts'] is not None:
+            kwargs['hosts'] = options['hosts']
+        rows = list(suite(**kwargs))
+        if not rows:
+            raise CommandError('suite %s produced no results' % options['suite'])
+        if options['json']:
+            for row in rows:
+                self.stdout.write(json.dumps(row))
+            return
+        columns = list(rows[0])
+        self.stdout.write(' | '.join(columns))
+        for row in rows:
+            self.stdout.write(' | '.join(
+                '%.3f' % row[c] if isinstance(row[c], float) else str(row[c]) for c in columns))
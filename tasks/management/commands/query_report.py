@@ -0,0 +1,89 @@
+import re
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import RegexURLResolver, get_resolver, reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from alpha.utils.queries import QueryStats, get_query_budget
+
+
+def url_patterns(resolver=None, namespace=None):
+    """
+    (view name, pattern) of every url reachable from `resolver`.
+    """
+    resolver = resolver or get_resolver(None)
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, RegexURLResolver):
+            inner = pattern.namespace and ':'.join(filter(None, [namespace, pattern.namespace]))
+            for found in url_patterns(pattern, inner or namespace):
+                yield found
+        elif pattern.name:
+            yield ':'.join(filter(None, [namespace, pattern.name])), pattern
+
+
+def sample_kwargs(pattern):
+    """
+    Arguments to reverse `pattern` with: the latest object of its view's
+    model for a `pk`, None when some argument cannot be made up.
+    """
+    kwargs = {}
+    for name in re.compile(pattern.regex.pattern).groupindex:
+        model = getattr(getattr(pattern.callback, 'view_class', None), 'model', None)
+        if name != 'pk' or model is None:
+            return None
+        obj = model._default_manager.order_by('-pk').first()
+        if obj is None:
+            return None
+        kwargs[name] = obj.pk
+    return kwargs
+
+
+class Command(BaseCommand):
+    help = 'GET every named url and report its queries against the budget of its view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='user to log in as, the first superuser by default')
+        parser.add_argument('--admin', action='store_true', help='include the admin site')
+        parser.add_argument('--strict', action='store_true',
+                            help='fail when a view is over its budget or repeats a query')
+
+    def handle(self, *args, **options):
+        users = get_user_model()._default_manager
+        if options['username']:
+            user = users.get(username=options['username'])
+        else:
+            user = users.filter(is_superuser=True).first()
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        columns = ['view', 'path', 'status', 'queries', 'db (ms)', 'budget', 'repeats']
+        self.stdout.write(' | '.join(columns))
+        failed = []
+        for (view_name, pattern) in url_patterns():
+            if view_name.startswith('admin:') and not options['admin']:
+                continue
+            kwargs = sample_kwargs(pattern)
+            if kwargs is None:
+                self.stdout.write('%s | skipped, needs %s' % (
+                    view_name, ', '.join(re.compile(pattern.regex.pattern).groupindex)))
+                continue
+            path = reverse(view_name, kwargs=kwargs)
+            budget = get_query_budget(pattern.callback, view_name)
+            with transaction.atomic(), override_settings(QUERY_BUDGET_ENABLED=False):
+                with CaptureQueriesContext(connection) as context:
+                    response = client.get(path)
+                    # streams are not consumed, only their setup is counted
+                    response.close()
+                transaction.set_rollback(True)
+            stats = QueryStats(context.captured_queries)
+            if stats.over(budget):
+                failed.append(view_name)
+            self.stdout.write(' | '.join(str(value) for value in [
+                view_name, path, response.status_code, stats.count, '%.1f' % (stats.time * 1000),
+                budget, len(stats.duplicates) + len(stats.repeated)]))
+            if stats.over(budget):
+                self.stdout.write(stats.report(budget))
+        if failed and options['strict']:
+            raise CommandError('over budget: %s' % ', '.join(failed))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_auto_20160602_1301'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CmdHostResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=64, verbose_name='hostname')),
+                ('status', models.CharField(choices=[('ok', 'ok'), ('failed', 'failed'), ('unreachable', 'unreachable')], max_length=16, verbose_name='host status')),
+                ('result', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='host_results', to='tasks.CmdResult')),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RepoHostResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=64, verbose_name='hostname')),
+                ('status', models.CharField(choices=[('ok', 'ok'), ('failed', 'failed'), ('unreachable', 'unreachable')], max_length=16, verbose_name='host status')),
+                ('result', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='host_results', to='tasks.RepoResult')),
+            ],
+            options={
+                'ordering': ['created'],
+                'abstract': False,
+            },
+        ),
+    ]
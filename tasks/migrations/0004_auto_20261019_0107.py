@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0003_cmdhostresult_repohostresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cmdresult',
+            name='forks',
+            field=models.IntegerField(default=0, verbose_name='forks'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='forks',
+            field=models.IntegerField(default=0, verbose_name='forks'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_auto_20261019_0107'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runneroption',
+            name='control_persist',
+            field=models.IntegerField(default=60, help_text='seconds to keep idle ssh master connections open, 0 to disable multiplexing'),
+        ),
+        migrations.AddField(
+            model_name='runneroption',
+            name='pipelining',
+            field=models.BooleanField(default=False, help_text='requires requiretty to be disabled in sudoers, not used with su'),
+        ),
+        migrations.AddField(
+            model_name='runneroption',
+            name='timeout',
+            field=models.IntegerField(default=10, help_text='ssh connection timeout in seconds'),
+        ),
+        migrations.AddField(
+            model_name='runneroption',
+            name='transfer_method',
+            field=models.IntegerField(choices=[(0, 'smart'), (1, 'sftp'), (2, 'scp')], default=0),
+        ),
+    ]
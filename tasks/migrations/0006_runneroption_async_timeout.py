@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_auto_20261019_0108'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runneroption',
+            name='async_timeout',
+            field=models.IntegerField(default=0, help_text='run the module in the background for at most this many seconds, 0 to wait for it'),
+        ),
+    ]
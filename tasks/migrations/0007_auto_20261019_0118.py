@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_runneroption_async_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cmdhostresult',
+            name='duration',
+            field=models.FloatField(default=0, verbose_name='duration'),
+        ),
+        migrations.AddField(
+            model_name='cmdresult',
+            name='duration',
+            field=models.FloatField(default=0, verbose_name='play duration'),
+        ),
+        migrations.AddField(
+            model_name='cmdresult',
+            name='host_max',
+            field=models.FloatField(default=0, verbose_name='slowest host duration'),
+        ),
+        migrations.AddField(
+            model_name='cmdresult',
+            name='host_p50',
+            field=models.FloatField(default=0, verbose_name='median host duration'),
+        ),
+        migrations.AddField(
+            model_name='cmdresult',
+            name='host_p95',
+            field=models.FloatField(default=0, verbose_name='95th percentile host duration'),
+        ),
+        migrations.AddField(
+            model_name='cmdresult',
+            name='slowest_hosts',
+            field=models.TextField(blank=True, verbose_name='slowest hosts'),
+        ),
+        migrations.AddField(
+            model_name='repohostresult',
+            name='duration',
+            field=models.FloatField(default=0, verbose_name='duration'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='duration',
+            field=models.FloatField(default=0, verbose_name='play duration'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='host_max',
+            field=models.FloatField(default=0, verbose_name='slowest host duration'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='host_p50',
+            field=models.FloatField(default=0, verbose_name='median host duration'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='host_p95',
+            field=models.FloatField(default=0, verbose_name='95th percentile host duration'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='slowest_hosts',
+            field=models.TextField(blank=True, verbose_name='slowest hosts'),
+        ),
+    ]
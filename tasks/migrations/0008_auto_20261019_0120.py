@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_auto_20261019_0118'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cmdresult',
+            name='finished',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='date finished'),
+        ),
+        migrations.AddField(
+            model_name='cmdresult',
+            name='host_count',
+            field=models.IntegerField(default=0, verbose_name='number of hosts'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='finished',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='date finished'),
+        ),
+        migrations.AddField(
+            model_name='reporesult',
+            name='host_count',
+            field=models.IntegerField(default=0, verbose_name='number of hosts'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_auto_20261019_0120'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cmdhostresult',
+            name='changed',
+            field=models.BooleanField(default=False, verbose_name='changed'),
+        ),
+        migrations.AddField(
+            model_name='cmdhostresult',
+            name='rc',
+            field=models.IntegerField(blank=True, null=True, verbose_name='return code'),
+        ),
+        migrations.AddField(
+            model_name='repohostresult',
+            name='changed',
+            field=models.BooleanField(default=False, verbose_name='changed'),
+        ),
+        migrations.AddField(
+            model_name='repohostresult',
+            name='rc',
+            field=models.IntegerField(blank=True, null=True, verbose_name='return code'),
+        ),
+        migrations.AlterIndexTogether(
+            name='cmdhostresult',
+            index_together=set([('host', 'created'), ('status', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='repohostresult',
+            index_together=set([('host', 'created'), ('status', 'created')]),
+        ),
+    ]
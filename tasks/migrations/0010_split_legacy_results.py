@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ast
+import json
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def load_results(text):
+    """
+    The results of a run: JSON, or the repr of a list of dicts for the
+    runs stored before they were.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+def legacy_statuses(ret_code, count):
+    """
+    Runs stored before host results were streamed kept one dict of hosts
+    per status that had any host, in the order ok, failed, unreachable.
+    The play return code is a single value: 4 when any host was
+    unreachable, else 2 when any host failed. One status per group, None
+    for the groups it does not tell apart, see host_fields.
+    """
+    if count == 3:
+        return ['ok', 'failed', 'unreachable']
+    if count == 1 and ret_code in (0, 2, 4):
+        return [{0: 'ok', 2: 'failed', 4: 'unreachable'}[ret_code]]
+    if count == 2 and ret_code == 2:
+        return ['ok', 'failed']
+    if count == 2 and ret_code == 4:
+        # ok or failed, and unreachable
+        return [None, 'unreachable']
+    return [None] * count
+
+
+def host_fields(status, result):
+    if isinstance(result, dict):
+        if result.get('unreachable'):
+            status = 'unreachable'
+        elif result.get('failed'):
+            status = 'failed'
+        return dict(status=status or 'ok', rc=result.get('rc'), changed=bool(result.get('changed')))
+    return dict(status=status, rc=None, changed=False)
+
+
+def known_statuses(statuses, groups):
+    """
+    Whether the status of every host of `groups` is known: from its group,
+    or else from its result, which output strings of commands do not tell.
+    """
+    return all(status is not None or all(isinstance(result, dict) for result in group.values())
+               for (status, group) in zip(statuses, groups))
+
+
+def split_results(run_model, host_model):
+    for run in run_model.objects.filter(host_results__isnull=True).iterator():
+        try:
+            groups = load_results(run.results)
+        except (ValueError, SyntaxError):
+            continue
+        if not isinstance(groups, list) or not all(isinstance(group, dict) for group in groups):
+            continue
+        statuses = legacy_statuses(run.ret_code, len(groups))
+        if not known_statuses(statuses, groups):
+            # left as it is rather than labelled wrong
+            continue
+        rows = []
+        for (status, group) in zip(statuses, groups):
+            for (host, result) in group.items():
+                rows.append(host_model(run=run, host=host, result=json.dumps(result),
+                                       **host_fields(status, result)))
+        host_model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        host_model.objects.filter(run=run).update(created=run.created)
+        run_model.objects.filter(pk=run.pk).update(host_count=len(rows), finished=run.created)
+
+
+def fill_host_fields(host_model):
+    last = 0
+    while True:
+        rows = list(host_model.objects.filter(pk__gt=last).order_by('pk')[:BATCH_SIZE])
+        if not rows:
+            break
+        for row in rows:
+            try:
+                result = json.loads(row.result)
+            except ValueError:
+                continue
+            fields = host_fields(row.status, result)
+            if (row.rc, row.changed) != (fields['rc'], fields['changed']):
+                host_model.objects.filter(pk=row.pk).update(rc=fields['rc'], changed=fields['changed'])
+        last = rows[-1].pk
+
+
+def forwards(apps, schema_editor):
+    for (run_model, host_model) in (('RepoResult', 'RepoHostResult'), ('CmdResult', 'CmdHostResult')):
+        fill_host_fields(apps.get_model('tasks', host_model))
+        split_results(apps.get_model('tasks', run_model), apps.get_model('tasks', host_model))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0009_auto_20261019_0123'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
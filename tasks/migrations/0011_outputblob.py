@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import zlib
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 500
+
+
+def move_outputs(apps, schema_editor):
+    OutputBlob = apps.get_model('tasks', 'OutputBlob')
+    for name in ('RepoHostResult', 'CmdHostResult'):
+        model = apps.get_model('tasks', name)
+        last = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'result')[:BATCH_SIZE])
+            if not rows:
+                break
+            pks, texts = defaultdict(list), {}
+            for (pk, text) in rows:
+                digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                pks[digest].append(pk)
+                texts[digest] = text
+            stored = set(OutputBlob.objects.filter(pk__in=list(texts)).values_list('pk', flat=True))
+            OutputBlob.objects.bulk_create([
+                OutputBlob(digest=digest, size=len(text), data=zlib.compress(text.encode('utf-8')))
+                for (digest, text) in texts.items() if digest not in stored
+            ])
+            for (digest, digest_pks) in pks.items():
+                model.objects.filter(pk__in=digest_pks).update(output=digest)
+            last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0010_split_legacy_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutputBlob',
+            fields=[
+                ('digest', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField(default=0, verbose_name='uncompressed size')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cmdhostresult',
+            name='output',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tasks.OutputBlob'),
+        ),
+        migrations.AddField(
+            model_name='repohostresult',
+            name='output',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tasks.OutputBlob'),
+        ),
+        migrations.RunPython(move_outputs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='cmdhostresult',
+            name='result',
+        ),
+        migrations.RemoveField(
+            model_name='repohostresult',
+            name='result',
+        ),
+        migrations.AlterField(
+            model_name='cmdhostresult',
+            name='output',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tasks.OutputBlob'),
+        ),
+        migrations.AlterField(
+            model_name='repohostresult',
+            name='output',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tasks.OutputBlob'),
+        ),
+    ]
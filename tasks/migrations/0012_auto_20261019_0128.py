@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_outputblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostDailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('host', models.CharField(max_length=64, verbose_name='hostname')),
+                ('kind', models.CharField(choices=[('repo', 'repo'), ('cmd', 'cmd')], max_length=16, verbose_name='kind of run')),
+                ('ok', models.IntegerField(default=0, verbose_name='ok')),
+                ('failed', models.IntegerField(default=0, verbose_name='failed')),
+                ('unreachable', models.IntegerField(default=0, verbose_name='unreachable')),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RepoDailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('runs', models.IntegerField(default=0, verbose_name='runs')),
+                ('failed', models.IntegerField(default=0, verbose_name='failed runs')),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='tasks.Repo')),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='cmdresult',
+            options={'ordering': ['pk']},
+        ),
+        migrations.AlterModelOptions(
+            name='reporesult',
+            options={'ordering': ['pk']},
+        ),
+        migrations.AlterField(
+            model_name='cmdresult',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='date created'),
+        ),
+        migrations.AlterField(
+            model_name='reporesult',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='date created'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hostdailystat',
+            unique_together=set([('day', 'host', 'kind')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='repodailystat',
+            unique_together=set([('day', 'repo')]),
+        ),
+    ]
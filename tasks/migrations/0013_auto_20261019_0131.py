@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0012_auto_20261019_0128'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cmdhostresult',
+            name='batch',
+            field=models.IntegerField(default=0, verbose_name='rolling deploy batch'),
+        ),
+        migrations.AddField(
+            model_name='repohostresult',
+            name='batch',
+            field=models.IntegerField(default=0, verbose_name='rolling deploy batch'),
+        ),
+        migrations.AddField(
+            model_name='runneroption',
+            name='max_fail_percentage',
+            field=models.IntegerField(blank=True, help_text='stop a rolling deploy once more than this percentage of the hosts of a batch failed, blank to stop only when all of them failed', null=True),
+        ),
+        migrations.AddField(
+            model_name='runneroption',
+            name='serial',
+            field=models.CharField(blank=True, help_text='hosts per batch of a rolling deploy, a number or a percentage like 20%, blank to deploy to every host at once', max_length=16),
+        ),
+    ]
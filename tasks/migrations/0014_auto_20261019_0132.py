@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0013_auto_20261019_0131'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepoHostRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=64, verbose_name='hostname')),
+                ('revision', models.CharField(max_length=32, verbose_name='revision')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='date updated')),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='host_revisions', to='tasks.Repo')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='repohostrevision',
+            unique_together=set([('repo', 'host')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0014_auto_20261019_0132'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reporesult',
+            name='action',
+            field=models.CharField(blank=True, editable=False, help_text='digest of the revision and hosts asked for, identical actions share a run', max_length=32),
+        ),
+    ]
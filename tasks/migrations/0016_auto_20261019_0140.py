@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:40
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_repos(apps, schema_editor):
+    Repo = apps.get_model('tasks', 'Repo')
+    RepoSearchToken = apps.get_model('tasks', 'RepoSearchToken')
+    for repo in Repo.objects.iterator():
+        tokens = set(token[:64] for text in (repo.name, repo.url)
+                     for token in re.split(r'\W+', text.lower(), flags=re.U) if token)
+        RepoSearchToken.objects.bulk_create([RepoSearchToken(repo=repo, token=token) for token in tokens])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0015_reporesult_action'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepoSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=64)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='repo',
+            index_together=set([('updated', 'id')]),
+        ),
+        migrations.AddField(
+            model_name='reposearchtoken',
+            name='repo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='tasks.Repo'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reposearchtoken',
+            unique_together=set([('repo', 'token')]),
+        ),
+        migrations.RunPython(index_repos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 01:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0016_auto_20261019_0140'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='runneroption',
+            name='pipelining',
+            field=models.NullBooleanField(default=None, help_text='requires requiretty to be disabled in sudoers, not used with su, unknown to keep the setting of ansible.cfg'),
+        ),
+    ]
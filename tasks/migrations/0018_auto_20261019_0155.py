@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-19 01:55
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0017_auto_20261019_0152'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='runneroption',
+            name='serial',
+            field=models.CharField(blank=True, help_text='hosts per batch of a rolling deploy, a number or a percentage like 20%, blank to deploy to every host at once', max_length=16, validators=[django.core.validators.RegexValidator('^(\\d+|(\\d{1,2}|100)%)$', message='Enter a number of hosts or a percentage of them up to 100%, like 20%.')]),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ast
+import json
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def results_to_json(apps, schema_editor):
+    """
+    Runs stored the repr of their results, rewrite it as JSON.
+    """
+    for name in ('RepoResult', 'CmdResult'):
+        model = apps.get_model('tasks', name)
+        last = 0
+        while True:
+            runs = list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'results')[:BATCH_SIZE])
+            if not runs:
+                break
+            for (pk, results) in runs:
+                try:
+                    json.loads(results)
+                    continue
+                except ValueError:
+                    pass
+                try:
+                    value = ast.literal_eval(results)
+                except (ValueError, SyntaxError):
+                    continue
+                model.objects.filter(pk=pk).update(results=json.dumps(value))
+            last = runs[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0018_auto_20261019_0155'),
+    ]
+
+    operations = [
+        migrations.RunPython(results_to_json, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,21 @@
 from __future__ import unicode_literals
 
+import datetime
+import hashlib
+import json
+import re
 import uuid
+import zlib
 from django.utils.translation import ugettext_lazy as _
-from django.db import models
+from django.core.cache import cache
+from django.core.validators import RegexValidator
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Max
 from django.utils import timezone
 
 from accounts.models import User
+from alpha.utils.base import bulk_update, generate_md5, getter, percentile
+from alpha.utils.events import publish
 from inventory.models import Host, Hostgroup
 
 BECOME_METHOD = (
@@ -18,6 +28,28 @@ BECOME_METHOD = (
     (6, 'dzdo')
 )
 
+TRANSFER_METHOD = (
+    (0, 'smart'),
+    (1, 'sftp'),
+    (2, 'scp'),
+)
+
+RUN_KIND = (
+    ('repo', 'repo'),
+    ('cmd', 'cmd'),
+)
+
+# hosts per batch of a rolling deploy, see tasks.tasks.serial_batches
+SERIAL_VALIDATOR = RegexValidator(
+    r'^(\d+|(\d{1,2}|100)%)$',
+    message=_('Enter a number of hosts or a percentage of them up to 100%, like 20%.'))
+
+HOST_RESULT_STATUS = (
+    ('ok', _('ok')),
+    ('failed', _('failed')),
+    ('unreachable', _('unreachable')),
+)
+
 
 class RunnerOption(models.Model):
     name = models.CharField(max_length=128, unique=True)
@@ -25,10 +57,78 @@ class RunnerOption(models.Model):
     become_user = models.CharField(max_length=64, default='root')
     become_method = models.IntegerField(choices=BECOME_METHOD, default=1)
     remote_user = models.CharField(max_length=64, default='root')
+    control_persist = models.IntegerField(
+        default=60, help_text=_('seconds to keep idle ssh master connections open, 0 to disable multiplexing'))
+    pipelining = models.NullBooleanField(
+        default=None, help_text=_('requires requiretty to be disabled in sudoers, not used with su, unknown to keep the setting of ansible.cfg'))
+    transfer_method = models.IntegerField(choices=TRANSFER_METHOD, default=0)
+    timeout = models.IntegerField(
+        default=10, help_text=_('ssh connection timeout in seconds'))
+    async_timeout = models.IntegerField(
+        default=0, help_text=_('run the module in the background for at most this many seconds, 0 to wait for it'))
+    serial = models.CharField(
+        max_length=16, blank=True, validators=[SERIAL_VALIDATOR],
+        help_text=_('hosts per batch of a rolling deploy, a number or a percentage like 20%, blank to deploy to every host at once'))
+    max_fail_percentage = models.IntegerField(
+        null=True, blank=True,
+        help_text=_('stop a rolling deploy once more than this percentage of the hosts of a batch failed, blank to stop only when all of them failed'))
 
     def __unicode__(self):
         return '%s -> %s' % (self.name, self.module_name)
 
+    def get_connection_kwargs(self):
+        return {
+            'control_persist': self.control_persist,
+            'pipelining': self.pipelining,
+            'transfer_method': self.get_transfer_method_display(),
+            'timeout': self.timeout,
+        }
+
+    def get_rolling_kwargs(self):
+        return {
+            'serial': self.serial,
+            'max_fail_percentage': self.max_fail_percentage,
+        }
+
+
+SEARCH_VERSION_KEY = 'repo_search_version'
+
+
+def search_tokens(*texts):
+    """
+    Lower cased words of `texts`, a repo search matches their beginning.
+    """
+    return set(token[:64] for text in texts for token in re.split(r'\W+', text.lower(), flags=re.U) if token)
+
+
+class RepoQuerySet(models.QuerySet):
+
+    def search(self, term):
+        """
+        Repos having, for every word of `term`, a word of their name or url
+        starting with it. Words are matched on the RepoSearchToken index,
+        the repos found are cached per term until a repo changes, in the
+        cache every web process shares.
+        """
+        words = sorted(search_tokens(term))
+        if not words:
+            # nothing but punctuation matches no repo
+            return self.none() if term.strip() else self
+        key = 'repo_search:%s:%s' % (cache.get(SEARCH_VERSION_KEY, 0),
+                                     generate_md5(' '.join(words).encode('utf-8')))
+        pks = cache.get(key)
+        if pks is None:
+            found = None
+            for word in words:
+                # a range rather than startswith, which mysql cannot match
+                # on the index as it compares with LIKE BINARY
+                matches = set(RepoSearchToken.objects.filter(
+                    token__gte=word, token__lt=word + '\uffff').values_list('repo', flat=True))
+                found = matches if found is None else found & matches
+            pks = list(found)
+            cache.set(key, pks, getter('REPO_SEARCH_CACHE_TIMEOUT', 300))
+        return self.filter(pk__in=pks)
+
 
 class Repo(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -47,26 +147,129 @@ class Repo(models.Model):
     created = models.DateTimeField(_('date created'), auto_now_add=True)
     updated = models.DateTimeField(_('date updated'), auto_now=True)
 
+    objects = RepoQuerySet.as_manager()
+
     def __unicode__(self):
         return u'%s -> %s' % (self.name, self.url)
 
     class Meta:
         verbose_name = verbose_name_plural = _('repository')
+        # keyset of the repo list, see tasks.views.RepoListView
+        index_together = [('updated', 'id')]
+
+    def update_search_tokens(self):
+        tokens = search_tokens(self.name, self.url)
+        self.search_tokens.exclude(token__in=tokens).delete()
+        tokens.difference_update(self.search_tokens.values_list('token', flat=True))
+        RepoSearchToken.objects.bulk_create([RepoSearchToken(repo=self, token=token) for token in tokens])
+
+
+class RepoSearchToken(models.Model):
+    """
+    A word of the name or the url of a repo, see RepoQuerySet.search.
+    """
+    repo = models.ForeignKey(Repo, related_name='search_tokens')
+    token = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        unique_together = ('repo', 'token')
+
+    def __unicode__(self):
+        return self.token
+
+
+class ResultQuerySet(models.QuerySet):
+
+    def in_flight(self):
+        """
+        Runs not finished yet. Runs left unfinished for longer than
+        ANSIBLE_RUN_TIMEOUT seconds are taken for dead workers.
+        """
+        started_after = timezone.now() - datetime.timedelta(seconds=getter('ANSIBLE_RUN_TIMEOUT', 3600))
+        return self.filter(finished__isnull=True, created__gt=started_after)
 
 
 class Result(models.Model):
     ret_code = models.IntegerField(
         default=0, verbose_name=_('play return code'))
     results = models.TextField()
-    created = models.DateTimeField(_('date created'), auto_now_add=True)
+    forks = models.IntegerField(default=0, verbose_name=_('forks'))
+    duration = models.FloatField(default=0, verbose_name=_('play duration'))
+    host_p50 = models.FloatField(default=0, verbose_name=_('median host duration'))
+    host_p95 = models.FloatField(default=0, verbose_name=_('95th percentile host duration'))
+    host_max = models.FloatField(default=0, verbose_name=_('slowest host duration'))
+    slowest_hosts = models.TextField(blank=True, verbose_name=_('slowest hosts'))
+    host_count = models.IntegerField(default=0, verbose_name=_('number of hosts'))
+    created = models.DateTimeField(_('date created'), auto_now_add=True, db_index=True)
+    finished = models.DateTimeField(_('date finished'), null=True, blank=True)
+
+    objects = ResultQuerySet.as_manager()
 
     class Meta:
         abstract = True
-        ordering = ['created']
+        # the primary key follows creation and needs no sort
+        ordering = ['pk']
+
+    def finish(self, ret_code, results, timings, **fields):
+        """
+        Record the outcome of the run. Only the outcome fields are saved,
+        shards of the run may still be updating the others.
+        """
+        self.ret_code = ret_code
+        self.results = json.dumps(results)
+        self.set_timings(timings)
+        self.finished = timezone.now()
+        for (name, value) in fields.items():
+            setattr(self, name, value)
+        self.save(update_fields=['ret_code', 'results', 'finished', 'duration', 'host_p50',
+                                 'host_p95', 'host_max', 'slowest_hosts'] + list(fields))
+        publish(self.get_channel(), 'finished',
+                dict(run=self.pk, ret_code=ret_code, summary=results))
+
+    def get_channel(self):
+        """
+        Name of the event channel the progress of this run is published to,
+        one per run.
+        """
+        return '%s:%s' % (self._meta.model_name, self.pk)
+
+    def get_results(self):
+        return json.loads(self.results)
+
+    def set_timings(self, timings):
+        self.duration = timings['duration']
+        self.host_p50 = timings['p50']
+        self.host_p95 = timings['p95']
+        self.host_max = timings['max']
+        self.slowest_hosts = json.dumps(timings['slowest'])
+
+    def get_timings(self, slowest=10):
+        """
+        Timings computed from the stored host results, for runs whose hosts
+        were played by several runners (shards, async polls).
+        """
+        durations = self.host_results.order_by('-duration').values_list('host', 'duration')
+        values = [duration for (_, duration) in durations]
+        return dict(
+            duration=(timezone.now() - self.created).total_seconds(),
+            p50=percentile(values, 50),
+            p95=percentile(values, 95),
+            max=percentile(values, 100),
+            slowest=list(durations[:slowest]),
+        )
+
+    def get_summary(self):
+        summary = dict.fromkeys(dict(HOST_RESULT_STATUS), 0)
+        summary.update(self.host_results.order_by().values_list(
+            'status').annotate(Count('pk')))
+        return summary
 
 
 class RepoResult(Result):
     repo = models.ForeignKey(Repo, related_name='results')
+    action = models.CharField(
+        max_length=32, blank=True, editable=False,
+        help_text=_('digest of the revision and hosts asked for, identical actions share a run'))
     executor = models.ForeignKey(
         User, null=True, related_name='repo_executor',
         editable=False, verbose_name=_('operation executor'))
@@ -74,6 +277,53 @@ class RepoResult(Result):
     def __unicode__(self):
         return '%s -> %s' % (self.repo.id, self.ret_code)
 
+    def get_channel(self):
+        # one per repo, watchers of a repo follow its next runs
+        return 'repo:%s' % self.repo_id
+
+
+class RepoHostRevision(models.Model):
+    """
+    Revision a repo was last deployed at on a host.
+    """
+    repo = models.ForeignKey(Repo, related_name='host_revisions')
+    host = models.CharField(max_length=64, verbose_name=_('hostname'))
+    revision = models.CharField(max_length=32, verbose_name=_('revision'))
+    updated = models.DateTimeField(_('date updated'), auto_now=True)
+
+    class Meta:
+        unique_together = ('repo', 'host')
+
+    def __unicode__(self):
+        return '%s %s -> %s' % (self.repo_id, self.host, self.revision)
+
+    @classmethod
+    def record(cls, repo, revisions):
+        """
+        Record `revisions`, a mapping of host to the revision of `repo` it is at.
+        """
+        stored = dict(cls.objects.filter(repo=repo, host__in=list(revisions)).values_list('host', 'pk'))
+        bulk_update(cls, dict((pk, {'revision': revisions[host]}) for (host, pk) in stored.items()),
+                    updated=timezone.now())
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([cls(repo=repo, host=host, revision=revision)
+                                         for (host, revision) in revisions.items() if host not in stored])
+        except IntegrityError:
+            # recorded by another run of the repo in the meantime
+            for (host, revision) in revisions.items():
+                if host not in stored:
+                    cls.objects.update_or_create(repo=repo, host=host, defaults={'revision': revision})
+
+    @classmethod
+    def outdated(cls, repo, hosts, revision):
+        """
+        The `hosts` not known to be at `revision` of `repo`, in order.
+        """
+        current = set(cls.objects.filter(repo=repo, host__in=hosts, revision=revision).values_list(
+            'host', flat=True))
+        return [host for host in hosts if host not in current]
+
 
 class CmdResult(Result):
     cmd = models.TextField()
@@ -83,3 +333,139 @@ class CmdResult(Result):
 
     def __unicode__(self):
         return self.cmd
+
+
+class OutputBlob(models.Model):
+    """
+    Output of a host, zlib compressed and stored once per content whatever
+    the number of hosts that returned it.
+    """
+    digest = models.CharField(max_length=40, primary_key=True)
+    data = models.BinaryField()
+    size = models.IntegerField(default=0, verbose_name=_('uncompressed size'))
+    created = models.DateTimeField(_('date created'), auto_now_add=True)
+
+    @staticmethod
+    def serialize(value):
+        """
+        JSON text of `value`: keys sorted so that equal outputs share a
+        digest, and other than ASCII characters kept as they are, escaping
+        them takes up to 6 times their UTF-8 size.
+        """
+        text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        return text.decode('utf-8') if isinstance(text, bytes) else text
+
+    @staticmethod
+    def get_digest(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def store(cls, texts):
+        """
+        Store the `texts` not stored yet and return their digests, in order.
+        """
+        digests = [cls.get_digest(text) for text in texts]
+        missing = dict(zip(digests, texts))
+        for digest in cls.objects.filter(pk__in=list(missing)).values_list('pk', flat=True):
+            missing.pop(digest)
+        blobs = [cls(digest=digest, size=len(text), data=zlib.compress(text.encode('utf-8')))
+                 for (digest, text) in missing.items()]
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(blobs)
+        except IntegrityError:
+            # another worker stored some of them in the meantime
+            for blob in blobs:
+                cls.objects.get_or_create(digest=blob.digest, defaults=dict(
+                    size=blob.size, data=blob.data))
+        return digests
+
+    def get_text(self):
+        return zlib.decompress(bytes(self.data)).decode('utf-8')
+
+    def __unicode__(self):
+        return self.digest
+
+
+class HostResultQuerySet(models.QuerySet):
+
+    def last_per_host(self):
+        """
+        The latest row of each host, e.g. `.filter(status='failed').last_per_host()`
+        for the last failure of every host.
+        """
+        return self.filter(pk__in=self.order_by().values('host').annotate(
+            last=Max('pk')).values('last'))
+
+
+class HostResult(models.Model):
+    host = models.CharField(max_length=64, verbose_name=_('hostname'))
+    status = models.CharField(
+        max_length=16, choices=HOST_RESULT_STATUS, verbose_name=_('host status'))
+    rc = models.IntegerField(null=True, blank=True, verbose_name=_('return code'))
+    changed = models.BooleanField(default=False, verbose_name=_('changed'))
+    output = models.ForeignKey(OutputBlob, related_name='+', on_delete=models.PROTECT)
+    duration = models.FloatField(default=0, verbose_name=_('duration'))
+    batch = models.IntegerField(default=0, verbose_name=_('rolling deploy batch'))
+    created = models.DateTimeField(_('date created'), auto_now_add=True)
+
+    objects = HostResultQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+        ordering = ['created']
+        index_together = [('host', 'created'), ('status', 'created')]
+
+    def get_result(self):
+        return json.loads(self.output.get_text())
+
+
+class RepoHostResult(HostResult):
+    run = models.ForeignKey(RepoResult, related_name='host_results')
+
+    def __unicode__(self):
+        return '%s -> %s' % (self.host, self.status)
+
+
+class CmdHostResult(HostResult):
+    run = models.ForeignKey(CmdResult, related_name='host_results')
+
+    def __unicode__(self):
+        return '%s -> %s' % (self.host, self.status)
+
+
+class RepoDailyStat(models.Model):
+    """
+    Runs of a repo per day, kept after the runs themselves are purged.
+    """
+    day = models.DateField(_('day'))
+    repo = models.ForeignKey(Repo, related_name='daily_stats')
+    runs = models.IntegerField(default=0, verbose_name=_('runs'))
+    failed = models.IntegerField(default=0, verbose_name=_('failed runs'))
+
+    class Meta:
+        unique_together = ('day', 'repo')
+        ordering = ['day']
+
+    def __unicode__(self):
+        return '%s %s: %s/%s' % (self.day, self.repo_id, self.failed, self.runs)
+
+
+class HostDailyStat(models.Model):
+    """
+    Host results per day and kind of run, kept after the results
+    themselves are purged.
+    """
+    day = models.DateField(_('day'))
+    host = models.CharField(max_length=64, verbose_name=_('hostname'))
+    kind = models.CharField(max_length=16, choices=RUN_KIND, verbose_name=_('kind of run'))
+    ok = models.IntegerField(default=0, verbose_name=_('ok'))
+    failed = models.IntegerField(default=0, verbose_name=_('failed'))
+    unreachable = models.IntegerField(default=0, verbose_name=_('unreachable'))
+
+    class Meta:
+        unique_together = ('day', 'host', 'kind')
+        ordering = ['day']
+
+    def __unicode__(self):
+        return '%s %s %s' % (self.day, self.host, self.kind)
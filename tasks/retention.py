@@ -0,0 +1,149 @@
+from __future__ import unicode_literals
+
+import datetime
+from collections import Counter, defaultdict
+from django.db import transaction
+from django.utils import timezone
+
+from alpha.utils import bulk_update, getter
+from .models import (CmdHostResult, CmdResult, HostDailyStat, OutputBlob,
+                     RepoDailyStat, RepoHostResult, RepoResult)
+
+# kind of run: (run model, host result model)
+RESULT_MODELS = {
+    'repo': (RepoResult, RepoHostResult),
+    'cmd': (CmdResult, CmdHostResult),
+}
+
+
+def local_day(value):
+    return timezone.localtime(value).date()
+
+
+def add_counts(model, counts, key_fields, **filters):
+    """
+    Add `counts`, a mapping of key to Counter of fields, to the stat rows
+    of `model` whose `key_fields` equal the key, creating the missing ones.
+    """
+    if not counts:
+        return
+    stats = model.objects.select_for_update().filter(**filters).filter(**dict(
+        ('%s__in' % name, set(key[i] for key in counts)) for (i, name) in enumerate(key_fields)))
+    stats = dict((tuple(getattr(stat, name) for name in key_fields), stat) for stat in stats)
+    changes, created = {}, []
+    for (key, counter) in counts.items():
+        stat = stats.get(key)
+        if stat is None:
+            created.append(model(**dict(filters, **dict(zip(key_fields, key), **counter))))
+        else:
+            changes[stat.pk] = dict((name, getattr(stat, name) + count)
+                                    for (name, count) in counter.items())
+    bulk_update(model, changes)
+    model.objects.bulk_create(created)
+
+
+def rollup_hosts(kind, rows):
+    counts = defaultdict(Counter)
+    for (host, status, created) in rows:
+        counts[(local_day(created), host)][str(status)] += 1
+    add_counts(HostDailyStat, counts, ('day', 'host'), kind=kind)
+
+
+def rollup_repos(rows):
+    counts = defaultdict(Counter)
+    for (repo, ret_code, created) in rows:
+        counts[(local_day(created), repo)]['runs'] += 1
+        counts[(local_day(created), repo)]['failed'] += 1 if ret_code else 0
+    add_counts(RepoDailyStat, counts, ('day', 'repo_id'))
+
+
+def purge_boundary(model, max_age=None, max_count=None):
+    """
+    Highest primary key to purge: the runs older than `max_age` days and
+    the ones past the `max_count` newest. None when nothing is due.
+    """
+    bounds = []
+    if max_age:
+        created_before = timezone.now() - datetime.timedelta(days=max_age)
+        bounds.extend(model.objects.filter(created__lt=created_before).order_by(
+            '-created').values_list('pk', flat=True)[:1])
+    if max_count:
+        bounds.extend(model.objects.order_by('-pk').values_list(
+            'pk', flat=True)[max_count:max_count + 1])
+    return max(bounds) if bounds else None
+
+
+def purge_host_results(kind, model, runs, chunk_size):
+    while True:
+        with transaction.atomic():
+            rows = list(model.objects.filter(run__in=runs).order_by('pk').values_list(
+                'pk', 'host', 'status', 'created')[:chunk_size])
+            if not rows:
+                return
+            rollup_hosts(kind, [row[1:] for row in rows])
+            model.objects.filter(pk__in=[row[0] for row in rows]).delete()
+
+
+def purge_runs(kind, max_age=None, max_count=None, chunk_size=1000):
+    """
+    Roll up and delete the runs of `kind` past their retention. Every
+    transaction rolls up and deletes at most `chunk_size` rows picked by
+    primary key, so no lock is held for long.
+    """
+    run_model, host_model = RESULT_MODELS[kind]
+    boundary = purge_boundary(run_model, max_age, max_count)
+    purged = 0
+    while boundary is not None:
+        runs = list(run_model.objects.filter(pk__lte=boundary).order_by(
+            'pk').values_list('pk', flat=True)[:chunk_size])
+        if not runs:
+            break
+        purge_host_results(kind, host_model, runs, chunk_size)
+        with transaction.atomic():
+            if kind == 'repo':
+                rollup_repos(run_model.objects.filter(pk__in=runs).values_list(
+                    'repo', 'ret_code', 'created'))
+            run_model.objects.filter(pk__in=runs).delete()
+        purged += len(runs)
+    return purged
+
+
+def purge_blobs(chunk_size=1000):
+    """
+    Delete the outputs no host result points to anymore.
+    """
+    purged, last = 0, ''
+    while True:
+        digests = list(OutputBlob.objects.filter(pk__gt=last).order_by(
+            'pk').values_list('pk', flat=True)[:chunk_size])
+        if not digests:
+            break
+        used = set()
+        for (_, host_model) in RESULT_MODELS.values():
+            used.update(host_model.objects.filter(output__in=digests).values_list(
+                'output', flat=True).distinct())
+        unused = [digest for digest in digests if digest not in used]
+        if unused:
+            with transaction.atomic():
+                # a play writing rows pointing to them waits for the lock,
+                # those written since they were read are kept. A play that
+                # found one of them stored writes it again, see
+                # tasks.tasks.HostResultSink.
+                unused = set(OutputBlob.objects.select_for_update().filter(
+                    pk__in=unused).values_list('pk', flat=True))
+                for (_, host_model) in RESULT_MODELS.values():
+                    unused.difference_update(host_model.objects.filter(
+                        output__in=list(unused)).values_list('output', flat=True).distinct())
+                if unused:
+                    purged += OutputBlob.objects.filter(pk__in=list(unused)).delete()[0]
+        last = digests[-1]
+    return purged
+
+
+def purge_results():
+    retention = getter('ANSIBLE_RESULT_RETENTION', {})
+    chunk_size = getter('ANSIBLE_PURGE_CHUNK_SIZE', 1000)
+    purged = dict((kind, purge_runs(kind, chunk_size=chunk_size, **retention.get(kind, {})))
+                  for kind in RESULT_MODELS)
+    purged['blobs'] = purge_blobs(chunk_size)
+    return purged
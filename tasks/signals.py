@@ -0,0 +1,23 @@
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SEARCH_VERSION_KEY, Repo
+
+
+@receiver(post_save, sender=Repo)
+def update_search_tokens(sender, instance, **kwargs):
+    instance.update_search_tokens()
+    invalidate_search(sender)
+
+
+@receiver(post_delete, sender=Repo)
+def invalidate_search(sender, **kwargs):
+    # never expires, a search cached for an older version is never read again
+    cache.add(SEARCH_VERSION_KEY, 0, None)
+    try:
+        cache.incr(SEARCH_VERSION_KEY)
+    except ValueError:
+        cache.set(SEARCH_VERSION_KEY, 1)
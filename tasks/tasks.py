@@ -1,35 +1,396 @@
-import copy
+import json
+import logging
+import time
+from collections import defaultdict
+from celery import chord
 from celery.task import task
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
 
-from alpha.utils import MyRunner
-from .models import RepoResult
+from alpha.utils import MyRunner, StreamingResultsCollector, getter
+from alpha.utils.events import publish
+from .models import (CmdHostResult, CmdResult, OutputBlob, Repo, RepoHostResult,
+                     RepoHostRevision, RepoResult)
+from .retention import purge_results
 
+logger = logging.getLogger(__name__)
 
-def del_invocation(x):
-    x1 = copy.deepcopy(x)
-    x1.pop('invocation', None)
-    return x1
 
+# what is kept of a module result, see project()
+REPO_RESULT_FIELDS = ('changed', 'failed', 'unreachable', 'msg', 'rc',
+                      'stdout', 'stderr', 'before', 'after', 'ansible_job_id')
 
-def g_results(ret_code, callback, func, model, **kwargs):
-    hosts = filter(lambda x: x if x() else None, [
-                   callback.host_ok, callback.host_failed, callback.host_unreachable])
-    results = map(func, hosts)
-    model.objects.create(ret_code=ret_code, results=results, **kwargs)
-    return results
+
+def project(result, fields):
+    """
+    The `fields` of a module result. Values are shared with the result, not
+    copied, and everything else of it (invocation, *_lines duplicates,
+    ansible internals) is left behind.
+    """
+    return dict((name, result[name]) for name in fields if name in result)
+
+
+CMD_OUTPUT_KEYS = {
+    'ok': 'stdout',
+    'failed': 'stderr',
+    'unreachable': 'msg'
+}
+
+
+def cmd_projector(status, result):
+    # never None, which would drop the host from the run
+    return result._result.get(CMD_OUTPUT_KEYS[status]) or result._result.get('msg') or ''
+
+
+class HostResultSink(object):
+    """
+    Stores each batch of host records and publishes it to the watchers of
+    the run, see tasks.views.RunEventsView. Outputs are stored as
+    OutputBlob, watchers get their digest.
+    """
+
+    def __init__(self, model, run, batch=0):
+        self.model = model
+        self.run = run
+        self.batch = batch
+
+    attempts = 3
+
+    def __call__(self, records):
+        texts = [OutputBlob.serialize(record['result']) for record in records]
+        for attempt in range(self.attempts):
+            digests = OutputBlob.store(texts)
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create([
+                        self.model(run=self.run, host=record['host'], status=record['status'],
+                                   rc=record.get('rc'), changed=record.get('changed', False),
+                                   output_id=digest, duration=record.get('duration', 0),
+                                   batch=self.batch)
+                        for (record, digest) in zip(records, digests)
+                    ])
+                break
+            except IntegrityError:
+                # an output store() found was purged before the rows
+                # pointing to it were written, store() writes it again
+                if attempt == self.attempts - 1:
+                    raise
+        publish(self.run.get_channel(), 'hosts', dict(run=self.run.pk, hosts=[
+            dict(host=record['host'], status=record['status'],
+                 rc=record.get('rc'), changed=record.get('changed', False),
+                 output=digest, duration=record.get('duration', 0),
+                 batch=self.batch)
+            for (record, digest) in zip(records, digests)
+        ]))
+
+
+def stream_results(runner, func, host_model, run, batch=0):
+    callback = StreamingResultsCollector(
+        sink=HostResultSink(host_model, run, batch),
+        projector=func,
+        batch_size=getter('ANSIBLE_RESULT_BATCH_SIZE', 100),
+        flush_interval=getter('ANSIBLE_RESULT_FLUSH_INTERVAL', 2))
+    return runner.run(callback=callback)
+
+
+def play_results(runner, func, host_model, run):
+    ret_code, callback = stream_results(runner, func, host_model, run)
+    run.finish(ret_code, callback.summary(), callback.timings(), forks=runner.forks)
+    return run, callback
+
+
+def s_results(runner, func, model, host_model, **kwargs):
+    run = model.objects.create(**kwargs)
+    return play_results(runner, func, host_model, run)
+
+
+def split_hosts(hosts, shard_size):
+    return [hosts[i:i + shard_size] for i in range(0, len(hosts), shard_size)]
+
+
+def serial_batches(hosts, serial):
+    """
+    The batches of a rolling deploy, `serial` being the number of hosts per
+    batch or a percentage of the hosts like '20%'.
+    """
+    serial = str(serial).strip()
+    if serial.endswith('%'):
+        size = int(len(hosts) * float(serial[:-1]) / 100)
+    else:
+        size = int(serial) or len(hosts)
+    # at least one host per batch, even with no hosts at all
+    return split_hosts(hosts, max(1, size))
+
+
+def batch_failed(summary, size, max_fail_percentage=None):
+    """
+    Whether a rolling deploy stops after a batch of `size` hosts, like the
+    serial plays of ansible: more than `max_fail_percentage` of the batch
+    failed, or all of it when no percentage is given.
+    """
+    failed = summary['failed'] + summary['unreachable']
+    if max_fail_percentage is None:
+        return failed == size
+    return failed * 100.0 / size > max_fail_percentage
+
+
+def rolling_results(run, batches, max_fail_percentage=None, **kwargs):
+    """
+    Play the `batches` of hosts back to back on `run`, the hosts of the
+    batches left once one of them failed are not played at all.
+    """
+    ret_code, forks, summaries = 0, 0, []
+    for (number, batch) in enumerate(batches):
+        runner = MyRunner(restriction=batch, **kwargs)
+        batch_code, callback = stream_results(runner,
+                                              func=repo_projector,
+                                              host_model=RepoHostResult,
+                                              run=run,
+                                              batch=number)
+        ret_code = max(ret_code, batch_code)
+        forks = max(forks, runner.forks)
+        summaries.append(callback.summary())
+        if batch_failed(summaries[-1], len(batch), max_fail_percentage):
+            break
+    summary = run.get_summary()
+    summary['batches'] = summaries
+    summary['skipped'] = sum(len(batch) for batch in batches[len(summaries):])
+    run.finish(ret_code, summary, run.get_timings(), forks=forks)
+    return run
+
+
+def repo_projector(status, result):
+    return project(result._result, REPO_RESULT_FIELDS)
+
+
+def async_projector(jobs):
+    """
+    Projects finished results like repo_projector, jobs still running in
+    the background are put into `jobs` instead.
+    """
+    def projector(status, result):
+        if status == 'ok' and not result._result.get('finished', 1):
+            jobs[result._host.get_name()] = result._result['ansible_job_id']
+            return None
+        return repo_projector(status, result)
+    return projector
+
+
+def get_revision(result):
+    after = result.get('after')
+    if after:
+        return after[0].split(':')[1].strip()
+
+
+def host_revisions(run):
+    """
+    Revision of the repo on each host of `run` that succeeded, every
+    distinct output is read once.
+    """
+    hosts = defaultdict(list)
+    for (host, digest) in run.host_results.filter(status='ok').values_list('host', 'output'):
+        hosts[digest].append(host)
+    revisions = {}
+    for blob in OutputBlob.objects.filter(pk__in=list(hosts)):
+        revision = get_revision(json.loads(blob.get_text()))
+        if revision:
+            revisions.update(dict.fromkeys(hosts[blob.pk], revision))
+    return revisions
+
+
+def set_repo_revision(run, revision):
+    # only the revision, the repo may have been edited meanwhile
+    Repo.objects.filter(pk=run.repo_id).update(revision=revision, updated=timezone.now())
+
+
+def update_revision(run):
+    revisions = host_revisions(run)
+    RepoHostRevision.record(run.repo, revisions)
+    if run.ret_code == 0 and revisions:
+        set_repo_revision(run, revisions.values()[0])
+
+
+def play_repo_action(run, **kwargs):
+    shard_size = kwargs.pop('shard_size', getter('ANSIBLE_SHARD_SIZE'))
+    serial = kwargs.pop('serial', None)
+    max_fail_percentage = kwargs.pop('max_fail_percentage', None)
+    revision = kwargs.pop('revision', None)
+    force = kwargs.pop('force', False)
+    runner = MyRunner(**kwargs)
+    hosts = runner.get_hosts()
+    if revision and not force:
+        # leave out the hosts already at the revision asked for
+        hosts = runner.restriction = RepoHostRevision.outdated(run.repo, hosts, revision)
+        if not hosts:
+            run.finish(0, run.get_summary(), run.get_timings())
+            set_repo_revision(run, revision)
+            return run.ret_code, run.results
+    run.host_count = len(hosts)
+    run.save(update_fields=['host_count'])
+    batches = serial_batches(hosts, serial) if serial else [hosts]
+    if len(batches) > 1:
+        # a batch must be done before the next one starts, so the
+        # module is never left running in the background.
+        rolling_results(run, batches, max_fail_percentage, **dict(kwargs, async_timeout=0))
+        update_revision(run)
+        return run.ret_code, run.results
+    if runner.async_timeout:
+        # start the module on every host and release the worker,
+        # repo_async_poller collects the results as they finish.
+        jobs = {}
+        stream_results(runner,
+                       func=async_projector(jobs),
+                       host_model=RepoHostResult,
+                       run=run)
+        run.forks = runner.forks
+        run.save(update_fields=['forks'])
+        repo_async_poller.apply_async(
+            (run.pk, jobs, time.time() + runner.async_timeout), kwargs,
+            countdown=getter('ANSIBLE_ASYNC_POLL_INTERVAL', 10))
+        return None, {'pending': len(jobs)}
+    if shard_size and len(hosts) > shard_size:
+        # fan the play out over several workers, repo_shard_merge
+        # records the merged return code once every shard is done.
+        shards = split_hosts(hosts, shard_size)
+        chord(repo_shard_runner.s(run.pk, shard, **kwargs)
+              for shard in shards)(repo_shard_merge.s(run.pk))
+        return None, {'shards': len(shards)}
+    run, callback = play_results(runner,
+                                 func=repo_projector,
+                                 host_model=RepoHostResult,
+                                 run=run)
+    update_revision(run)
+    return run.ret_code, callback.summary()
+
+
+def fail_run(run):
+    """
+    Finish `run` with return code 1 unless it is finished already: a run
+    left unfinished holds back the next actions of its repo and keeps its
+    watchers waiting.
+    """
+    if not type(run).objects.filter(pk=run.pk, finished__isnull=False).exists():
+        run.finish(1, run.get_summary(), run.get_timings())
+
+
+@task(max_retries=None)
+def repo_runner(run_id, *args, **kwargs):
+    """
+    Play the repo action recorded as run `run_id`, once the actions
+    submitted before it for the same repo are finished: two plays never
+    share the checkout of a repo.
+    """
+    run = RepoResult.objects.select_related('repo').get(pk=run_id)
+    if RepoResult.objects.in_flight().filter(repo=run.repo_id, pk__lt=run.pk).exists():
+        # retried for as long as they take, see max_retries
+        raise repo_runner.retry(countdown=getter('ANSIBLE_REPO_RETRY_INTERVAL', 10))
+    try:
+        return play_repo_action(run, **kwargs)
+    except:
+        # HostPatternError is not an Exception
+        fail_run(run)
+        raise
+
+
+@task
+def cmd_runner(run_id, *args, **kwargs):
+    run = CmdResult.objects.get(pk=run_id)
+    try:
+        run, callback = play_results(MyRunner(**kwargs),
+                                     func=cmd_projector,
+                                     host_model=CmdHostResult,
+                                     run=run)
+    except:
+        # HostPatternError is not an Exception
+        fail_run(run)
+        raise
+    return run.ret_code, callback.summary()
+
+
+@task(ignore_result=False)
+def repo_shard_runner(run_id, shard, *args, **kwargs):
+    """
+    Play the repo action on the hosts of `shard` and return the return
+    code. A shard never raises: the chord would not call repo_shard_merge
+    and the run would be left unfinished, holding back the next ones.
+    """
+    try:
+        runner = MyRunner(restriction=shard, **kwargs)
+        ret_code, _ = stream_results(runner,
+                                     func=repo_projector,
+                                     host_model=RepoHostResult,
+                                     run=RepoResult.objects.get(pk=run_id))
+    except:
+        # HostPatternError is not an Exception
+        logger.exception('shard of run %s failed', run_id)
+        return 1
+    RepoResult.objects.filter(pk=run_id).update(
+        forks=F('forks') + runner.forks)
+    return ret_code
+
+
+@task
+def repo_shard_merge(ret_codes, run_id):
+    run = RepoResult.objects.select_related('repo').get(pk=run_id)
+    run.finish(max(ret_codes), run.get_summary(), run.get_timings())
+    update_revision(run)
+    return run.ret_code, run.results
+
+
+@task
+def repo_async_poller(run_id, jobs, deadline, *args, **kwargs):
+    run = RepoResult.objects.select_related('repo').get(pk=run_id)
+    pending = {}
+    runner_kwargs = dict(kwargs,
+                         restriction=jobs.keys(),
+                         module_name='async_status',
+                         module_args='jid={{ async_jobs[inventory_hostname] }}',
+                         play_vars={'async_jobs': jobs},
+                         async_timeout=0)
+    try:
+        polled = []
+        if jobs:
+            _, callback = stream_results(MyRunner(**runner_kwargs),
+                                         func=async_projector(pending),
+                                         host_model=RepoHostResult,
+                                         run=run)
+            polled = callback.host_ok() + callback.host_failed() + callback.host_unreachable()
+        # hosts removed from the inventory since the last poll are not
+        # played, their job is given up
+        gone = set(jobs) - set(polled) - set(pending)
+        if gone:
+            HostResultSink(RepoHostResult, run)([
+                dict(host=host, status='failed',
+                     result={'msg': 'host left the inventory', 'ansible_job_id': jobs[host]})
+                for host in sorted(gone)
+            ])
+        if pending and time.time() < deadline:
+            repo_async_poller.apply_async(
+                (run_id, pending, deadline), kwargs,
+                countdown=getter('ANSIBLE_ASYNC_POLL_INTERVAL', 10))
+            return None, {'pending': len(pending)}
+        HostResultSink(RepoHostResult, run)([
+            dict(host=host, status='failed',
+                 result={'msg': 'async job timed out', 'ansible_job_id': jid})
+            for (host, jid) in pending.items()
+        ])
+        summary = run.get_summary()
+        # the worst outcome wins, like ansible's own exit codes
+        if summary['unreachable']:
+            ret_code = 4
+        elif summary['failed']:
+            ret_code = 2
+        else:
+            ret_code = 0
+        run.finish(ret_code, summary, run.get_timings())
+        update_revision(run)
+    except:
+        fail_run(run)
+        raise
+    return run.ret_code, run.results
 
 
 @task
-def repo_runner(user, repo, *args, **kwargs):
-    ret_code, callback = MyRunner(**kwargs).run()
-    results = g_results(ret_code, callback,
-                        func=lambda x: {h: del_invocation(
-                            r._result) for (h, r) in x().items()},
-                        model=RepoResult,
-                        repo=repo,
-                        executor=user)
-    if ret_code == 0:
-        result = callback.host_ok.values()[0]
-        repo.revision = result._result.get('after')[0].split(':')[1].strip()
-        repo.save()
-    return ret_code, results
+def results_purger():
+    return purge_results()
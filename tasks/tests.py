@@ -1,3 +1,696 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
 
-# Create your tests here.
+import datetime
+import json
+import os
+import sys
+import time
+from collections import Counter
+from importlib import import_module
+from ansible.plugins import connection_loader
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from accounts.models import User
+from alpha.utils import KeysetPaginationMixin, MyRunner, bulk_update, percentile
+from alpha.utils.ansible_api import ForkScheduler
+from alpha.utils.queries import assert_view_budget
+from inventory.models import Host, Hostgroup
+from . import forms
+from .models import (CmdHostResult, CmdResult, HostDailyStat, OutputBlob, Repo, RepoDailyStat, RepoHostResult,
+                     RepoHostRevision, RepoResult, RunnerOption, search_tokens)
+from .retention import add_counts, local_day, purge_blobs, purge_runs
+from .tasks import (HostResultSink, batch_failed, cmd_projector, play_repo_action, play_results,
+                    repo_async_poller, repo_runner, repo_shard_merge, repo_shard_runner, rolling_results,
+                    serial_batches, split_hosts)
+
+TEST_SETTINGS = dict(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ANSIBLE_EVENTS_ENABLED=False,
+)
+
+# plays reach their hosts through the connection plugin of the benchmarks,
+# without the latency it simulates
+FAKE_CONNECTION_PLUGINS = os.path.join(settings.BASE_DIR, 'alpha', 'utils', 'connection_plugins')
+os.environ.setdefault('FAKE_CONNECTION_RTT', '0')
+os.environ.setdefault('FAKE_CONNECTION_HANDSHAKE', '0')
+
+
+def fake_hosts(count):
+    return ['fake%04d' % i for i in range(count)]
+
+
+def fake_kwargs(hosts, module_name='command', module_args='true', **kwargs):
+    """
+    MyRunner keyword arguments playing `module_name` on `hosts`, see
+    tasks.benchmarks.fake_runner.
+    """
+    connection_loader.add_directory(FAKE_CONNECTION_PLUGINS)
+    runner_kwargs = dict(task_name='test', host_list='all', module_name=module_name,
+                         module_args=module_args, inventory_file=','.join(hosts) + ',',
+                         connection='fake', become=False, become_method='sudo', forks=len(hosts),
+                         play_vars={'ansible_python_interpreter': sys.executable})
+    runner_kwargs.update(kwargs)
+    return runner_kwargs
+
+
+def create_hosts(count, owner=None, prefix='host'):
+    hosts = [Host.objects.create(hostname='%s%03d' % (prefix, i), sudo_username='root', sudo_password='secret')
+             for i in range(count)]
+    if owner is not None:
+        for host in hosts:
+            host.owner.add(owner)
+    return hosts
+
+
+def create_repos(count, author, opts, hosts=(), hostgroups=()):
+    repos = []
+    for i in range(count):
+        repo = Repo.objects.create(name='repo%s' % i, author=author, url='svn://example.com/repo%s' % i,
+                                   username='svn', password='secret', revision='1', dest='/srv/repo%s' % i,
+                                   opts=opts)
+        repo.hosts.add(*hosts)
+        repo.hostgroups.add(*hostgroups)
+        repos.append(repo)
+    return repos
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryBudgetTests(TestCase):
+    """
+    The list and detail views run as many queries whatever the number of
+    rows they show, within the `query_budget` of the view.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret', is_staff=True)
+        self.client.force_login(self.user)
+        self.opts = RunnerOption.objects.create(name='svn', module_name='subversion')
+        RunnerOption.objects.create(name='shell', module_name='shell')
+        self.hosts = create_hosts(5, owner=self.user)
+        self.hostgroups = [Hostgroup.objects.create(name='group%s' % i) for i in range(3)]
+
+    def test_repo_list(self):
+        create_repos(15, self.user, self.opts, self.hosts, self.hostgroups)
+        response = assert_view_budget(self.client, reverse('tasks:repo_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['repo_list']), 10)
+
+    def test_repo_list_next_page(self):
+        create_repos(15, self.user, self.opts, self.hosts, self.hostgroups)
+        response = self.client.get(reverse('tasks:repo_list'))
+        response = assert_view_budget(self.client, '%s?%s' % (
+            reverse('tasks:repo_list'), urlencode({'after': response.context['next_cursor']})))
+        self.assertEqual(len(response.context['repo_list']), 5)
+
+    def test_repo_search(self):
+        create_repos(15, self.user, self.opts, self.hosts, self.hostgroups)
+        response = assert_view_budget(self.client, '%s?q=example+repo1' % reverse('tasks:repo_list'))
+        self.assertEqual(len(response.context['repo_list']), 6)
+
+    def test_repo_detail(self):
+        repo = create_repos(1, self.user, self.opts, self.hosts, self.hostgroups)[0]
+        response = assert_view_budget(self.client, reverse('tasks:repo_detail', kwargs={'pk': repo.pk}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_host_list(self):
+        create_hosts(20, owner=User.objects.create_user('bob', 'bob@example.com', 'secret'), prefix='web')
+        response = assert_view_budget(self.client, reverse('tasks:exec_cmd'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_cmd_result(self):
+        run = CmdResult.objects.create(cmd='uptime', executor=self.user, host_count=len(self.hosts))
+        digest = OutputBlob.store(['"up"'])[0]
+        CmdHostResult.objects.bulk_create([CmdHostResult(run=run, host=host.hostname, status='ok', output_id=digest)
+                                           for host in self.hosts])
+        response = assert_view_budget(self.client, reverse('tasks:cmd_result', kwargs={'pk': run.pk}))
+        self.assertEqual(len(response.json()['hosts']), len(self.hosts))
+
+
+@override_settings(**TEST_SETTINGS)
+class StreamingResultsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.run = CmdResult.objects.create(cmd='true', executor=self.user)
+
+    def play(self, hosts, **kwargs):
+        run, _ = play_results(MyRunner(**fake_kwargs(hosts, **kwargs)),
+                              func=cmd_projector, host_model=CmdHostResult, run=self.run)
+        run.refresh_from_db()
+        return run
+
+    def test_hosts_are_stored(self):
+        hosts = fake_hosts(5)
+        run = self.play(hosts)
+        self.assertEqual(run.ret_code, 0)
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(run.get_results(), {'ok': 5, 'failed': 0, 'unreachable': 0})
+        self.assertEqual(sorted(run.host_results.values_list('host', flat=True)), hosts)
+        self.assertEqual(set(run.host_results.values_list('rc', flat=True)), set([0]))
+
+    def test_failed_hosts(self):
+        run = self.play(fake_hosts(3), module_args='false')
+        self.assertEqual(run.ret_code, 2)
+        self.assertEqual(run.get_results(), {'ok': 0, 'failed': 3, 'unreachable': 0})
+        self.assertEqual(set(run.host_results.values_list('rc', flat=True)), set([1]))
+
+    def test_sink(self):
+        HostResultSink(CmdHostResult, self.run)([
+            dict(host='a', status='ok', rc=0, changed=True, result='done', duration=1.5),
+            dict(host='b', status='failed', rc=1, result='done'),
+        ])
+        a, b = self.run.host_results.order_by('host')
+        self.assertEqual((a.status, a.rc, a.changed, a.duration), ('ok', 0, True, 1.5))
+        self.assertEqual((b.status, b.rc, b.changed, b.duration), ('failed', 1, False, 0))
+        self.assertEqual(a.output_id, b.output_id)
+        self.assertEqual(a.get_result(), 'done')
+
+
+class RepoRunTestCase(TestCase):
+    """
+    A repo and a run of it, played on fake hosts with the command module.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        opts = RunnerOption.objects.create(name='svn', module_name='subversion')
+        self.repo = create_repos(1, self.user, opts)[0]
+        self.run = RepoResult.objects.create(repo=self.repo, executor=self.user)
+
+    def get_run(self):
+        return RepoResult.objects.get(pk=self.run.pk)
+
+
+@override_settings(**TEST_SETTINGS)
+class ShardTests(RepoRunTestCase):
+
+    def test_merge(self):
+        hosts = fake_hosts(4)
+        codes = [repo_shard_runner(self.run.pk, shard, **fake_kwargs(hosts, forks=2))
+                 for shard in split_hosts(hosts, 2)]
+        self.assertEqual(codes, [0, 0])
+        repo_shard_merge(codes, self.run.pk)
+        run = self.get_run()
+        self.assertEqual((run.ret_code, run.forks, run.host_results.count()), (0, 4, 4))
+        self.assertIsNotNone(run.finished)
+
+    def test_failed_shard(self):
+        self.assertEqual(repo_shard_runner(self.run.pk, ['nowhere'],
+                                           **fake_kwargs(fake_hosts(2), host_list='nowhere')), 1)
+        repo_shard_merge([0, 1], self.run.pk)
+        run = self.get_run()
+        self.assertEqual(run.ret_code, 1)
+        self.assertIsNotNone(run.finished)
+
+    @override_settings(CELERY_ALWAYS_EAGER=True)
+    def test_chord(self):
+        hosts = fake_hosts(5)
+        self.assertEqual(play_repo_action(self.run, shard_size=2, **fake_kwargs(hosts)), (None, {'shards': 3}))
+        run = self.get_run()
+        self.assertEqual(run.ret_code, 0)
+        self.assertEqual(run.get_results()['ok'], 5)
+        self.assertIsNotNone(run.finished)
+
+
+@override_settings(**TEST_SETTINGS)
+class ForkSchedulerTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_budget(self):
+        scheduler = ForkScheduler(budget=10, max_forks=8)
+        self.assertEqual(scheduler.acquire(20), 8)
+        self.assertEqual(scheduler.acquire(20), 2)
+        # never under min_forks, even over budget
+        self.assertEqual(scheduler.acquire(5), 1)
+        self.assertEqual(scheduler.in_use(), 11)
+        scheduler.release(8)
+        self.assertEqual(scheduler.acquire(20), 7)
+        self.assertEqual(scheduler.acquire(3), 1)
+
+    def test_shared_by_schedulers(self):
+        # two schedulers stand for two worker processes of the machine
+        first, second = ForkScheduler(budget=10), ForkScheduler(budget=10)
+        self.assertEqual(first.acquire(6), 6)
+        self.assertEqual(second.acquire(6), 4)
+        first.release(6)
+        self.assertEqual(second.in_use(), 4)
+        second.release(10)
+        self.assertEqual(first.in_use(), 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class AsyncPollerTests(RepoRunTestCase):
+
+    def poll(self, jobs, hosts=()):
+        return repo_async_poller(self.run.pk, jobs, time.time() + 60, **fake_kwargs(list(hosts)))
+
+    def test_worst_code_wins(self):
+        HostResultSink(RepoHostResult, self.run)([
+            dict(host='a', status='failed', result={'msg': 'failed'}),
+            dict(host='b', status='unreachable', result={'msg': 'unreachable'}),
+        ])
+        ret_code, results = self.poll({})
+        self.assertEqual(ret_code, 4)
+        self.assertEqual(results, {'ok': 0, 'failed': 1, 'unreachable': 1})
+        self.assertIsNotNone(self.get_run().finished)
+
+    def test_host_left_the_inventory(self):
+        ret_code, _ = self.poll({'gone': '1.2'}, hosts=fake_hosts(1))
+        self.assertEqual(ret_code, 2)
+        result = self.get_run().host_results.get()
+        self.assertEqual((result.host, result.status), ('gone', 'failed'))
+        self.assertEqual(result.get_result()['ansible_job_id'], '1.2')
+
+
+class PercentileTests(SimpleTestCase):
+
+    def test_percentile(self):
+        values = [7, 3, 10, 0, 5, 1, 9, 2, 8, 4, 6]
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([4.5], 95), 4.5)
+        self.assertEqual(percentile(values, 0), 0)
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile(values, 100), 10)
+
+
+def read_event(events):
+    """
+    Name and data of the next server-sent event, None for a heartbeat.
+    """
+    chunk = next(events).decode('utf-8')
+    if chunk.startswith(':'):
+        return None
+    event, data = chunk.strip().split('\n')
+    return event[len('event: '):], json.loads(data[len('data: '):])
+
+
+@override_settings(ANSIBLE_EVENTS_POLL_INTERVAL=0, **TEST_SETTINGS)
+class EventsViewTests(TransactionTestCase):
+    """
+    Events read from the database, the views give their connection back
+    while they wait, which the transaction of a TestCase would not survive.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.client.force_login(self.user)
+
+    def add_hosts(self, model, run, *hosts):
+        HostResultSink(model, run)([dict(host=host, status='ok', rc=0, result='') for host in hosts])
+
+    def get_events(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return iter(response.streaming_content)
+
+    def get_hosts(self, event):
+        self.assertEqual(event[0], 'hosts')
+        return [host['host'] for host in event[1]['hosts']]
+
+    def test_cmd_events(self):
+        run = CmdResult.objects.create(cmd='true', executor=self.user)
+        self.add_hosts(CmdHostResult, run, 'a', 'b')
+        events = self.get_events(reverse('tasks:cmd_events', kwargs={'pk': run.pk}))
+        self.assertEqual(self.get_hosts(read_event(events)), ['a', 'b'])
+        self.assertIsNone(read_event(events))
+        self.add_hosts(CmdHostResult, run, 'c')
+        run.finish(0, run.get_summary(), run.get_timings())
+        self.assertEqual(self.get_hosts(read_event(events)), ['c'])
+        self.assertEqual(read_event(events), ('finished', dict(
+            run=run.pk, ret_code=0, summary={'ok': 3, 'failed': 0, 'unreachable': 0})))
+        self.assertRaises(StopIteration, next, events)
+
+    def test_missing_cmd(self):
+        response = self.client.get(reverse('tasks:cmd_events', kwargs={'pk': 404}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_repo_events_follow_new_runs(self):
+        repo = create_repos(1, self.user, RunnerOption.objects.create(name='svn', module_name='subversion'))[0]
+        run = RepoResult.objects.create(repo=repo, executor=self.user)
+        self.add_hosts(RepoHostResult, run, 'a')
+        run.finish(0, run.get_summary(), run.get_timings())
+        events = self.get_events(reverse('tasks:repo_events', kwargs={'pk': repo.pk}))
+        self.assertEqual(self.get_hosts(read_event(events)), ['a'])
+        self.assertEqual(read_event(events)[0], 'finished')
+        self.add_hosts(RepoHostResult, RepoResult.objects.create(repo=repo, executor=self.user), 'b')
+        event = read_event(events)
+        self.assertEqual(self.get_hosts(event), ['b'])
+        self.assertNotEqual(event[1]['run'], run.pk)
+
+
+class LegacyResultsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.migration = import_module('tasks.migrations.0010_split_legacy_results')
+
+    def test_legacy_statuses(self):
+        legacy_statuses = self.migration.legacy_statuses
+        self.assertEqual(legacy_statuses(4, 3), ['ok', 'failed', 'unreachable'])
+        self.assertEqual(legacy_statuses(0, 1), ['ok'])
+        self.assertEqual(legacy_statuses(2, 1), ['failed'])
+        self.assertEqual(legacy_statuses(4, 1), ['unreachable'])
+        self.assertEqual(legacy_statuses(2, 2), ['ok', 'failed'])
+        self.assertEqual(legacy_statuses(4, 2), [None, 'unreachable'])
+        self.assertEqual(legacy_statuses(1, 2), [None, None])
+        self.assertEqual(legacy_statuses(0, 0), [])
+
+    def test_ambiguous_groups(self):
+        statuses = self.migration.legacy_statuses(4, 2)
+        self.assertTrue(self.migration.known_statuses(statuses, [{'a': {'failed': True}}, {'b': {}}]))
+        self.assertFalse(self.migration.known_statuses(statuses, [{'a': 'output'}, {'b': 'output'}]))
+        self.assertEqual(self.migration.host_fields(None, {'failed': True, 'rc': 1})['status'], 'failed')
+        self.assertEqual(self.migration.host_fields(None, {'rc': 0})['status'], 'ok')
+
+    def test_load_results(self):
+        results = [{'a': {'rc': 0}}, {}]
+        self.assertEqual(self.migration.load_results(json.dumps(results)), results)
+        self.assertEqual(self.migration.load_results(repr(results)), results)
+
+
+class OutputBlobTests(TestCase):
+
+    def test_store_dedup(self):
+        digests = OutputBlob.store(['"a"', '"b"', '"a"'])
+        self.assertEqual(len(digests), 3)
+        self.assertEqual(digests[0], digests[2])
+        self.assertNotEqual(digests[0], digests[1])
+        self.assertEqual(OutputBlob.store(['"b"', '"c"'])[0], digests[1])
+        self.assertEqual(OutputBlob.objects.count(), 3)
+
+    def test_serialize(self):
+        text = OutputBlob.serialize({'stdout': '中文', 'rc': 0})
+        self.assertEqual(text, '{"rc": 0, "stdout": "中文"}')
+        self.assertEqual(OutputBlob.serialize({'rc': 0, 'stdout': '中文'}), text)
+        digest = OutputBlob.store([text])[0]
+        self.assertEqual(OutputBlob.objects.get(pk=digest).get_text(), text)
+
+
+@override_settings(**TEST_SETTINGS)
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.today = timezone.localtime(timezone.now()).date()
+
+    def create_cmd_runs(self, count, *statuses):
+        runs = []
+        for i in range(count):
+            run = CmdResult.objects.create(cmd='true', executor=self.user)
+            HostResultSink(CmdHostResult, run)([dict(host='host%s' % j, status=status, result='run %s' % i)
+                                                for (j, status) in enumerate(statuses)])
+            runs.append(run)
+        return runs
+
+    def test_bulk_update(self):
+        stats = [HostDailyStat.objects.create(day=self.today, host=host, kind='cmd') for host in ('a', 'b', 'c')]
+        self.assertEqual(bulk_update(HostDailyStat, {}), 0)
+        self.assertEqual(bulk_update(HostDailyStat, {stats[0].pk: {'ok': 5}, stats[1].pk: {'failed': 3}},
+                                     unreachable=7), 2)
+        values = dict((host, (ok, failed, unreachable)) for (host, ok, failed, unreachable) in
+                      HostDailyStat.objects.values_list('host', 'ok', 'failed', 'unreachable'))
+        self.assertEqual(values, {'a': (5, 0, 7), 'b': (0, 3, 7), 'c': (0, 0, 0)})
+
+    def test_add_counts(self):
+        add_counts(HostDailyStat, {(self.today, 'a'): Counter(ok=2, failed=1)}, ('day', 'host'), kind='cmd')
+        add_counts(HostDailyStat, {(self.today, 'a'): Counter(ok=1), (self.today, 'b'): Counter(unreachable=4)},
+                   ('day', 'host'), kind='cmd')
+        add_counts(HostDailyStat, {(self.today, 'a'): Counter(ok=1)}, ('day', 'host'), kind='repo')
+        self.assertEqual(HostDailyStat.objects.count(), 3)
+        a = HostDailyStat.objects.get(day=self.today, host='a', kind='cmd')
+        self.assertEqual((a.ok, a.failed, a.unreachable), (3, 1, 0))
+        b = HostDailyStat.objects.get(day=self.today, host='b', kind='cmd')
+        self.assertEqual((b.ok, b.failed, b.unreachable), (0, 0, 4))
+
+    def test_purge_runs(self):
+        runs = self.create_cmd_runs(5, 'ok', 'failed')
+        self.assertEqual(purge_runs('cmd', max_count=2, chunk_size=2), 3)
+        self.assertEqual(list(CmdResult.objects.order_by('pk').values_list('pk', flat=True)),
+                         [run.pk for run in runs[3:]])
+        self.assertEqual(CmdHostResult.objects.count(), 4)
+        stats = dict((host, (ok, failed)) for (host, ok, failed) in HostDailyStat.objects.filter(
+            day=self.today, kind='cmd').values_list('host', 'ok', 'failed'))
+        self.assertEqual(stats, {'host0': (3, 0), 'host1': (0, 3)})
+        self.assertEqual(purge_runs('cmd', max_count=2), 0)
+
+    def test_purge_old_repo_runs(self):
+        repo = create_repos(1, self.user, RunnerOption.objects.create(name='svn', module_name='subversion'))[0]
+        old, new = [RepoResult.objects.create(repo=repo, executor=self.user) for i in range(2)]
+        for run in (old, new):
+            HostResultSink(RepoHostResult, run)([dict(host='a', status='ok', result={})])
+        created = timezone.now() - datetime.timedelta(days=40)
+        RepoResult.objects.filter(pk=old.pk).update(created=created, ret_code=2)
+        RepoHostResult.objects.filter(run=old).update(created=created)
+        self.assertEqual(purge_runs('repo', max_age=30), 1)
+        self.assertEqual(list(RepoResult.objects.values_list('pk', flat=True)), [new.pk])
+        stat = RepoDailyStat.objects.get()
+        self.assertEqual((stat.day, stat.repo_id, stat.runs, stat.failed), (local_day(created), repo.pk, 1, 1))
+        self.assertEqual(HostDailyStat.objects.get(kind='repo').day, local_day(created))
+
+    def test_purge_blobs(self):
+        runs = self.create_cmd_runs(2, 'ok')
+        OutputBlob.store(['"orphan"'])
+        runs[0].delete()
+        self.assertEqual(purge_blobs(chunk_size=1), 2)
+        self.assertEqual(list(OutputBlob.objects.values_list('pk', flat=True)),
+                         [runs[1].host_results.get().output_id])
+
+
+class RollingDeployTests(SimpleTestCase):
+
+    def test_serial_batches(self):
+        hosts = ['host%s' % i for i in range(10)]
+        self.assertEqual([len(batch) for batch in serial_batches(hosts, '3')], [3, 3, 3, 1])
+        self.assertEqual([len(batch) for batch in serial_batches(hosts, '20%')], [2] * 5)
+        self.assertEqual([len(batch) for batch in serial_batches(hosts, '5%')], [1] * 10)
+        self.assertEqual([len(batch) for batch in serial_batches(hosts, '1%')], [1] * 10)
+        self.assertEqual(serial_batches(hosts, '0'), [hosts])
+        self.assertEqual(sum(serial_batches(hosts, '4'), []), hosts)
+
+    def test_no_hosts(self):
+        for serial in ('0', '1%', '3'):
+            self.assertEqual(serial_batches([], serial), [])
+
+    def test_batch_failed(self):
+        self.assertFalse(batch_failed(dict(ok=3, failed=1, unreachable=0), 4))
+        self.assertTrue(batch_failed(dict(ok=0, failed=2, unreachable=2), 4))
+        self.assertFalse(batch_failed(dict(ok=3, failed=1, unreachable=0), 4, max_fail_percentage=25))
+        self.assertTrue(batch_failed(dict(ok=2, failed=1, unreachable=1), 4, max_fail_percentage=25))
+        self.assertTrue(batch_failed(dict(ok=3, failed=0, unreachable=1), 4, max_fail_percentage=0))
+
+
+@override_settings(**TEST_SETTINGS)
+class RollingResultsTests(RepoRunTestCase):
+
+    def test_all_batches(self):
+        hosts = fake_hosts(4)
+        rolling_results(self.run, serial_batches(hosts, '2'), **fake_kwargs(hosts))
+        run = self.get_run()
+        self.assertEqual(run.ret_code, 0)
+        self.assertEqual(sorted(run.host_results.values_list('batch', flat=True)), [0, 0, 1, 1])
+        self.assertEqual(run.get_results()['skipped'], 0)
+
+    def test_failed_batch_aborts(self):
+        hosts = fake_hosts(4)
+        rolling_results(self.run, serial_batches(hosts, '2'), **fake_kwargs(hosts, module_args='false'))
+        run = self.get_run()
+        self.assertEqual(run.ret_code, 2)
+        self.assertEqual(sorted(run.host_results.values_list('host', flat=True)), hosts[:2])
+        results = run.get_results()
+        self.assertEqual((results['failed'], results['skipped']), (2, 2))
+        self.assertEqual(len(results['batches']), 1)
+
+
+@override_settings(**TEST_SETTINGS)
+class RevisionTests(RepoRunTestCase):
+
+    def test_hosts_at_revision_are_skipped(self):
+        hosts = fake_hosts(3)
+        RepoHostRevision.record(self.repo, {hosts[0]: '5', hosts[1]: '5', hosts[2]: '4'})
+        self.assertEqual(play_repo_action(self.run, revision='5', **fake_kwargs(hosts))[0], 0)
+        run = self.get_run()
+        self.assertEqual(run.host_count, 1)
+        self.assertEqual(list(run.host_results.values_list('host', flat=True)), hosts[2:])
+
+    def test_every_host_at_revision(self):
+        hosts = fake_hosts(3)
+        RepoHostRevision.record(self.repo, dict.fromkeys(hosts, '5'))
+        self.assertEqual(play_repo_action(self.run, revision='5', **fake_kwargs(hosts))[0], 0)
+        run = self.get_run()
+        self.assertIsNotNone(run.finished)
+        self.assertFalse(run.host_results.exists())
+        repo = Repo.objects.get(pk=self.repo.pk)
+        self.assertEqual(repo.revision, '5')
+        self.assertGreater(repo.updated, self.repo.updated)
+
+    def test_forced(self):
+        hosts = fake_hosts(2)
+        RepoHostRevision.record(self.repo, dict.fromkeys(hosts, '5'))
+        play_repo_action(self.run, revision='5', force=True, **fake_kwargs(hosts))
+        self.assertEqual(self.get_run().host_results.count(), 2)
+
+
+@override_settings(**TEST_SETTINGS)
+class RepoQueueTests(RepoRunTestCase):
+
+    def test_queued_behind_run_in_flight(self):
+        later = RepoResult.objects.create(repo=self.repo, executor=self.user)
+        self.assertIsNone(repo_runner.max_retries)
+        with self.assertRaises(Retry):
+            repo_runner(later.pk, **fake_kwargs(fake_hosts(1)))
+        self.assertIsNone(RepoResult.objects.get(pk=later.pk).finished)
+        self.assertFalse(later.host_results.exists())
+
+    def test_played_once_earlier_runs_finished(self):
+        self.run.finish(0, self.run.get_summary(), self.run.get_timings())
+        later = RepoResult.objects.create(repo=self.repo, executor=self.user)
+        self.assertEqual(repo_runner(later.pk, **fake_kwargs(fake_hosts(2)))[0], 0)
+        self.assertEqual(later.host_results.count(), 2)
+
+
+class FakeTask(object):
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def delay(self, *args, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.calls.append((args, kwargs))
+
+
+@override_settings(**TEST_SETTINGS)
+class RepoActionFormTests(TransactionTestCase):
+    """
+    Actions are queued once their run is committed, which the transaction
+    of a TestCase never is.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        opts = RunnerOption.objects.create(name='svn', module_name='subversion')
+        self.repo = create_repos(1, self.user, opts, create_hosts(3))[0]
+        self.addCleanup(setattr, forms, 'repo_runner', forms.repo_runner)
+        self.runner = forms.repo_runner = FakeTask()
+
+    def submit(self, **data):
+        form = forms.RepoActionForm(self.user, self.repo, data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+    def test_identical_actions_share_a_run(self):
+        run, created = self.submit(revision=2)
+        self.assertTrue(created)
+        self.assertEqual(self.submit(revision=2), (run, False))
+        self.assertEqual(len(self.runner.calls), 1)
+        self.assertEqual(self.runner.calls[0][0], (run.pk,))
+
+    def test_other_actions_are_queued(self):
+        run, _ = self.submit(revision=2)
+        other, created = self.submit(revision=3)
+        self.assertTrue(created)
+        forced, created = self.submit(revision=2, force=True)
+        self.assertTrue(created)
+        self.assertEqual(len(set([run.pk, other.pk, forced.pk])), 3)
+        self.assertEqual([args for (args, _) in self.runner.calls], [(run.pk,), (other.pk,), (forced.pk,)])
+
+    def test_finished_action_runs_again(self):
+        run, _ = self.submit(revision=2)
+        RepoResult.objects.filter(pk=run.pk).update(finished=timezone.now())
+        again, created = self.submit(revision=2)
+        self.assertTrue(created)
+        self.assertNotEqual(again.pk, run.pk)
+
+    def test_broker_down(self):
+        forms.repo_runner = FakeTask(error=IOError('connection refused'))
+        with self.assertRaises(IOError):
+            self.submit(revision=2)
+        run = RepoResult.objects.get()
+        self.assertEqual(run.ret_code, 1)
+        self.assertIsNotNone(run.finished)
+        # the failed run does not hold the next submission back
+        self.runner = forms.repo_runner = FakeTask()
+        again, created = self.submit(revision=2)
+        self.assertTrue(created)
+        self.assertEqual(self.runner.calls[0][0], (again.pk,))
+
+
+@override_settings(**TEST_SETTINGS)
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        repos = create_repos(7, user, RunnerOption.objects.create(name='svn', module_name='subversion'))
+        now = timezone.now()
+        for (i, repo) in enumerate(repos):
+            # pairs of repos updated at the same time, told apart by pk
+            Repo.objects.filter(pk=repo.pk).update(updated=now - datetime.timedelta(minutes=i // 2))
+        self.expected = list(Repo.objects.order_by('-updated', '-pk').values_list('pk', flat=True))
+
+    def get_page(self, **params):
+        view = KeysetPaginationMixin()
+        view.model = Repo
+        view.page_size = 3
+        view.request = RequestFactory().get('/', params)
+        return view.paginate_keyset(Repo.objects.all())
+
+    def test_pages(self):
+        found, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = self.get_page(**({'after': cursor} if cursor else {}))
+            found.extend(row.pk for row in rows)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(found, self.expected)
+        self.assertEqual(pages, 3)
+
+    def test_bad_cursor(self):
+        for cursor in ('', 'nope', '2016-01-01T00:00:00,nope', 'nope,%s' % self.expected[0]):
+            rows, _ = self.get_page(after=cursor)
+            self.assertEqual([row.pk for row in rows], self.expected[:3])
+
+
+@override_settings(**TEST_SETTINGS)
+class RepoSearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.repos = create_repos(3, user, RunnerOption.objects.create(name='svn', module_name='subversion'))
+        for (repo, name) in zip(self.repos, ['alpha', 'beta', '部署 web']):
+            repo.name = name
+            repo.save()
+
+    def search(self, term):
+        return sorted(Repo.objects.search(term).values_list('name', flat=True))
+
+    def test_search_tokens(self):
+        self.assertEqual(search_tokens('部署 Web', 'svn://example.com/web-2'),
+                         set(['部署', 'web', 'svn', 'example', 'com', '2']))
+
+    def test_search(self):
+        self.assertEqual(self.search('alp'), ['alpha'])
+        self.assertEqual(self.search('ALPHA example.com'), ['alpha'])
+        self.assertEqual(self.search('example'), ['alpha', 'beta', '部署 web'])
+        self.assertEqual(self.search('部'), ['部署 web'])
+        self.assertEqual(self.search('alpha beta'), [])
+        self.assertEqual(self.search('!!'), [])
+        self.assertEqual(self.search(''), ['alpha', 'beta', '部署 web'])
+
+    def test_changed_repo_is_found(self):
+        self.assertEqual(self.search('gamma'), [])
+        self.repos[1].name = 'gamma'
+        self.repos[1].save()
+        self.assertEqual(self.search('gamma'), ['gamma'])
+        self.assertEqual(self.search('beta'), [])
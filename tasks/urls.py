@@ -1,11 +1,17 @@
 from django.conf.urls import include, url
 
-from .views import RepoCreateView, RepoListView, RepoDetailView, ExecCmdView
+from .views import RepoCreateView, RepoListView, RepoDetailView, ExecCmdView, CmdResultView, \
+    RepoEventsView, CmdEventsView, OutputView
 
 urlpatterns = [
     url(r'^repo/$', RepoListView.as_view(), name='repo_list'),
     url(r'^repo/create/$', RepoCreateView.as_view(), name='repo_create'),
     url(r'^repo/(?P<pk>[a-zA-Z0-9\-]+)/$',
         RepoDetailView.as_view(), name='repo_detail'),
+    url(r'^repo/(?P<pk>[a-zA-Z0-9\-]+)/events/$',
+        RepoEventsView.as_view(), name='repo_events'),
     url(r'^exec_cmd/$', ExecCmdView.as_view(), name='exec_cmd'),
+    url(r'^exec_cmd/(?P<pk>\d+)/$', CmdResultView.as_view(), name='cmd_result'),
+    url(r'^exec_cmd/(?P<pk>\d+)/events/$', CmdEventsView.as_view(), name='cmd_events'),
+    url(r'^output/(?P<digest>[0-9a-f]{40})/$', OutputView.as_view(), name='output'),
 ]
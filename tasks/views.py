@@ -1,20 +1,23 @@
 # -*- coding:utf-8 -*-
-import logging
+import json
 import os
 import re
+import time
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q
-from django.http import Http404
+from django.db import connection
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic import View
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, FormView
 from django.views.generic.list import ListView
-from django.core.urlresolvers import reverse_lazy
+from django.core.urlresolvers import reverse, reverse_lazy
 from django.utils.translation import ugettext_lazy as _
 
-from alpha.utils import BasicInfoMixin, MyRunner, add_message, StaffuserRequiredMixin
+from alpha.utils import BasicInfoMixin, JSONView, KeysetPaginationMixin, add_message, getter, StaffuserRequiredMixin
+from alpha.utils.events import Subscription, events_enabled, sse
 from .forms import RepoForm, RepoActionForm, CmdForm
-from .models import Repo, CmdResult
-from .tasks import g_results
+from .models import OutputBlob, Repo, RepoResult, CmdResult
 
 conv_dest = lambda x, y: x + os.path.sep + \
     y if x.endswith(os.path.sep) or not re.findall(y, x) else x
@@ -34,12 +37,14 @@ class RepoCreateView(StaffuserRequiredMixin, BasicInfoMixin, CreateView):
         return super(RepoCreateView, self).form_valid(form)
 
 
-class RepoListView(LoginRequiredMixin, BasicInfoMixin, ListView):
+class RepoListView(LoginRequiredMixin, BasicInfoMixin, KeysetPaginationMixin, ListView):
     template_name = 'tasks/repo_list.html'
     model = Repo
     search_parameter = 'q'
-    paginate_by = 10
+    page_size = 10
+    keyset_field = 'updated'
     head_title = _('Repo List')
+    query_budget = 10
 
     def get_context_data(self, **kwargs):
         ctx = super(RepoListView, self).get_context_data(**kwargs)
@@ -55,13 +60,11 @@ class RepoListView(LoginRequiredMixin, BasicInfoMixin, ListView):
     def search(self, qs):
         q = self.search_term()
         if q:
-            qs = qs.filter(
-                Q(name__icontains=q) | Q(url__icontains=q)
-            )
+            qs = qs.search(q)
         return qs
 
     def get_queryset(self):
-        qs = super(RepoListView, self).get_queryset()
+        qs = super(RepoListView, self).get_queryset().prefetch_related('hosts', 'hostgroups')
         if self.search_term():
             qs = self.search(qs)
         return qs
@@ -71,41 +74,41 @@ class RepoDetailView(LoginRequiredMixin, BasicInfoMixin, DetailView, FormView):
     template_name = 'tasks/repo_detail.html'
     model = Repo
     form_class = RepoActionForm
+    query_budget = 8
 
     def get_head_title(self):
         return _('Detail of %s(%s)' % (self.object.pk, self.object.name))
 
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return super(RepoDetailView, self).post(request, *args, **kwargs)
+
     def get_form_kwargs(self):
         kwargs = super(RepoDetailView, self).get_form_kwargs()
-        kwargs['repo'] = self.get_object()
+        kwargs['repo'] = self.object
         kwargs['user'] = self.request.user
         return kwargs
 
     def get_success_url(self):
-        return reverse_lazy('tasks:repo_detail', kwargs={'pk': self.get_object().pk})
-
-    def generate_results(self, task_results):
-        results = {}
-        for host, task_result in task_results.items():
-            result = task_result._result.copy()
-            _ = result.pop('invocation')
-            results[host] = result
-        return results
+        return reverse_lazy('tasks:repo_detail', kwargs={'pk': self.object.pk})
 
     def form_valid(self, form):
-        play_return = form.save()
-        add_message(self.request, 'task_sent')
+        run, created = form.save()
+        add_message(self.request, 'task_sent' if created else 'task_joined')
         return super(RepoDetailView, self).form_valid(form)
 
 
 class ExecCmdView(LoginRequiredMixin, BasicInfoMixin, FormView):
     template_name = 'tasks/exec_cmd.html'
     form_class = CmdForm
-    success_url = reverse_lazy('tasks:exec_cmd')
+    # the host list of the form, whatever the number of hosts
+    query_budget = 10
 
     def get_context_data(self, **kwargs):
         ctx = super(ExecCmdView, self).get_context_data(**kwargs)
         ctx['shell_results'] = CmdResult.objects.all()[:10]
+        run = self.request.GET.get('run', '')
+        ctx['run'] = CmdResult.objects.filter(pk=run).first() if run.isdigit() else None
         return ctx
 
     def get_form_kwargs(self):
@@ -113,18 +116,178 @@ class ExecCmdView(LoginRequiredMixin, BasicInfoMixin, FormView):
         kwargs['user'] = self.request.user
         return kwargs
 
+    def get_success_url(self):
+        return '%s?run=%s' % (reverse('tasks:exec_cmd'), self.run.pk)
+
     def form_valid(self, form):
-        ret_code, callback = form.save()
-        mapping = {
-            'host_ok': 'stdout',
-            'host_failed': 'stderr',
-            'host_unreachable': 'msg'
-        }
-        results = g_results(ret_code, callback,
-                            func=lambda x: {h: r._result.get(
-                                mapping[getattr(x, '__name__')]) for (h, r) in x().items()},
-                            model=CmdResult,
-                            cmd=form.cleaned_data['cmd'],
-                            executor=self.request.user)
-        logging.warning(results)
+        self.run = form.save()
+        add_message(self.request, 'task_sent')
         return super(ExecCmdView, self).form_valid(form)
+
+
+class CmdResultView(LoginRequiredMixin, JSONView):
+    """
+    Progress of an ad-hoc command. Host results are returned in the order
+    they were stored, pass the `last` id of a response as `since` to get
+    only the hosts that completed after it. Outputs are referenced by
+    digest, see OutputView.
+    """
+    page_size = 500
+    query_budget = 8
+
+    def get_since(self):
+        try:
+            return int(self.request.GET.get('since', 0))
+        except ValueError:
+            return 0
+
+    def get_data(self, context):
+        run = get_object_or_404(CmdResult, pk=self.kwargs['pk'])
+        hosts = list(run.host_results.filter(pk__gt=self.get_since()).order_by('pk').values(
+            'id', 'host', 'status', 'rc', 'changed', 'output', 'duration')[:self.page_size])
+        return {
+            'id': run.pk,
+            'cmd': run.cmd,
+            'finished': run.finished is not None,
+            'ret_code': run.ret_code if run.finished else None,
+            'host_count': run.host_count,
+            'summary': run.get_summary(),
+            'hosts': hosts,
+            'last': hosts[-1]['id'] if hosts else self.get_since(),
+        }
+
+
+class OutputView(LoginRequiredMixin, JSONView):
+    """
+    Output of a host result, decompressed only when somebody opens it. A
+    digest always names the same content, so browsers may keep it.
+    """
+
+    def get_data(self, context):
+        blob = get_object_or_404(OutputBlob, pk=self.kwargs['digest'])
+        return {
+            'digest': blob.digest,
+            'size': blob.size,
+            'output': json.loads(blob.get_text()),
+        }
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super(OutputView, self).render_to_response(context, **response_kwargs)
+        response['Cache-Control'] = 'private, max-age=31536000'
+        return response
+
+
+class RunEventsView(LoginRequiredMixin, View):
+    """
+    Server-sent events of a run: the host results stored so far, then the
+    ones published while the play goes on, then `finished`.
+
+    The stream waits on redis rather than on the database and gives its
+    database connection back once the stored results are sent. Serve it
+    from the gevent uWSGI instance (run_uwsgi_events.ini) so a watcher
+    costs a greenlet instead of a worker. Without redis the same events are
+    read from the database every ANSIBLE_EVENTS_POLL_INTERVAL seconds.
+    """
+    model = None
+    batch_size = 500
+    follow = False
+
+    def get_run(self):
+        return get_object_or_404(self.model, pk=self.kwargs['pk'])
+
+    def get_channel(self):
+        return self.model(pk=self.kwargs['pk']).get_channel()
+
+    def stored_events(self, run):
+        hosts = []
+        for host in run.host_results.order_by('pk').values(
+                'host', 'status', 'rc', 'changed', 'output', 'duration').iterator():
+            hosts.append(host)
+            if len(hosts) >= self.batch_size:
+                yield sse('hosts', dict(run=run.pk, hosts=hosts))
+                hosts = []
+        if hosts:
+            yield sse('hosts', dict(run=run.pk, hosts=hosts))
+
+    def stream(self, run, subscription):
+        try:
+            if run is not None:
+                # read after subscribing, so nothing published meanwhile is
+                # missed, watchers drop the hosts they get twice.
+                run.refresh_from_db()
+                for event in self.stored_events(run):
+                    yield event
+                if run.finished:
+                    yield sse('finished', dict(run=run.pk, ret_code=run.ret_code,
+                                               summary=run.get_summary()))
+            connection.close()
+            if run is not None and run.finished and not self.follow:
+                return
+            for message in subscription:
+                if message is None:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield sse(*message)
+                if message[0] == 'finished' and not self.follow:
+                    return
+        finally:
+            subscription.close()
+
+    def poll(self):
+        run_pk, last, finished = None, 0, False
+        deadline = time.time() + getter('ANSIBLE_EVENTS_TIMEOUT', 3600)
+        while time.time() < deadline:
+            run, sent = self.get_run(), False
+            if run is not None:
+                if run.pk != run_pk:
+                    run_pk, last, finished = run.pk, 0, False
+                while True:
+                    hosts = list(run.host_results.filter(pk__gt=last).order_by('pk').values(
+                        'id', 'host', 'status', 'rc', 'changed', 'output', 'duration')[:self.batch_size])
+                    if not hosts:
+                        break
+                    last, sent = hosts[-1]['id'], True
+                    yield sse('hosts', dict(run=run.pk, hosts=hosts))
+                if run.finished and not finished:
+                    finished = sent = True
+                    yield sse('finished', dict(run=run.pk, ret_code=run.ret_code,
+                                               summary=run.get_summary()))
+                    if not self.follow:
+                        return
+            connection.close()
+            if not sent:
+                yield ': heartbeat\n\n'
+            time.sleep(getter('ANSIBLE_EVENTS_POLL_INTERVAL', 2))
+
+    def get(self, request, *args, **kwargs):
+        run = self.get_run()
+        if events_enabled():
+            subscription = Subscription(self.get_channel(),
+                                        heartbeat=getter('ANSIBLE_EVENTS_HEARTBEAT', 15),
+                                        timeout=getter('ANSIBLE_EVENTS_TIMEOUT', 3600))
+            events = self.stream(run, subscription)
+        else:
+            events = self.poll()
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class RepoEventsView(RunEventsView):
+    """
+    Events of the latest run of a repo and of every run started while
+    watching it.
+    """
+    model = RepoResult
+    follow = True
+
+    def get_run(self):
+        return RepoResult.objects.filter(repo=self.kwargs['pk']).order_by('-pk').first()
+
+    def get_channel(self):
+        return 'repo:%s' % self.kwargs['pk']
+
+
+class CmdEventsView(RunEventsView):
+    model = CmdResult